@@ -0,0 +1,64 @@
+"""
+Micro-benchmark for the Iridium SBD decoder.
+
+Compares the original byte-by-byte loop with the table-driven layout, per
+message and per 1,000 messages (IridiumLayout.decode_many).
+
+    python -m benchmarks.bench_iridium_decode
+"""
+import random
+import struct
+import timeit
+from server.parser import IRIDIUM_LAYOUTS
+
+TAGS = {1: 'dissolved_oxygen', 2: 'conductivity', 3: 'pH', 4: 'temperature', 5: 'humidity'}
+
+
+def make_message():
+    body = b''.join(bytes([tag]) + struct.pack('<f', random.uniform(0, 40)) for tag in TAGS)
+    return b'\x01\x00' + body
+
+
+def legacy_decode(raw):
+    """The pre-registry decoder: one struct.unpack and an if/elif chain per record."""
+    payload = {}
+    i = 2
+    while i <= len(raw) - 5:
+        tag = raw[i]
+        value = struct.unpack('<f', raw[i + 1: i + 5])[0]
+        if tag == 1:
+            payload['dissolved_oxygen'] = value
+        elif tag == 2:
+            payload['conductivity'] = value
+        elif tag == 3:
+            payload['pH'] = value
+        elif tag == 4:
+            payload['temperature'] = value
+        elif tag == 5:
+            payload['humidity'] = value
+        i += 5
+    return payload
+
+
+def main(repeat=5):
+    layout = IRIDIUM_LAYOUTS['default']
+    message = make_message()
+    messages = [make_message() for _ in range(1000)]
+
+    assert legacy_decode(message) == layout.decode(message)
+    assert [legacy_decode(m) for m in messages] == layout.decode_many(messages)
+
+    cases = [
+        ("legacy, per message", lambda: legacy_decode(message), 10000),
+        ("layout.decode, per message", lambda: layout.decode(message), 10000),
+        ("legacy, per 1,000 messages", lambda: [legacy_decode(m) for m in messages], 20),
+        ("layout.decode, per 1,000 messages", lambda: [layout.decode(m) for m in messages], 20),
+        ("layout.decode_many, per 1,000 messages", lambda: layout.decode_many(messages), 20),
+    ]
+    for label, func, number in cases:
+        best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+        print(f"{label:<42} {best * 1e6:10.2f} us")
+
+
+if __name__ == "__main__":
+    main()
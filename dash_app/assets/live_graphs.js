@@ -0,0 +1,112 @@
+/* assets/live_graphs.js */
+
+window.dash_clientside = window.dash_clientside || {};
+window.dash_clientside.clientside = window.dash_clientside.clientside || {};
+
+// Parameters that are stored but never graphed
+const NOT_GRAPHED = ["latitude", "longitude"];
+
+// "YYYY-MM-DDTHH:MM:SS" wall-clock time in timeZone. Matches the naive x values
+// the server puts in the figures, so the strings also sort chronologically.
+function toLocalX(date, timeZone) {
+    const parts = {};
+    new Intl.DateTimeFormat("en-CA", {
+        timeZone: timeZone, hourCycle: "h23",
+        year: "numeric", month: "2-digit", day: "2-digit",
+        hour: "2-digit", minute: "2-digit", second: "2-digit"
+    }).formatToParts(date).forEach(p => { parts[p.type] = p.value; });
+    return `${parts.year}-${parts.month}-${parts.day}T${parts.hour}:${parts.minute}:${parts.second}`;
+}
+
+// Index of the first x >= cutoff (x is sorted)
+function firstIndexFrom(xs, cutoff) {
+    let lo = 0, hi = xs.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (String(xs[mid]).slice(0, 19) < cutoff) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+}
+
+// The rendered plot for a graph id. extendData and relayout change the plot in
+// place without updating the figure prop, so current data is read from here.
+function plotFor(graphId) {
+    const el = document.getElementById(JSON.stringify(graphId, Object.keys(graphId).sort()));
+    return el && el.querySelector(".js-plotly-plot");
+}
+
+// Widen the y axis when a live point falls outside the range the server picked
+function fitYRange(plot, value) {
+    const range = plot.layout && plot.layout.yaxis && plot.layout.yaxis.range;
+    if (!range || (value >= range[0] && value <= range[1])) return;
+    const low = Math.min(range[0], value), high = Math.max(range[1], value);
+    const pad = (high - low) * 0.1;
+    Plotly.relayout(plot, {"yaxis.range": [value < range[0] ? low - pad : low, value > range[1] ? high + pad : high]});
+}
+
+/*
+ * Appends a sensor_update to the graphs already on the page. Each graph gets
+ * one extendData: the new point on the history trace (trimmed from the left so
+ * only the current window is kept) and the Live markers moved to it. Cost is
+ * proportional to the new points, not the window. Falls back to a full rebuild
+ * (graph-refresh) when a parameter has no graph or the Live markers are missing.
+ * Hourly/daily traces plot bucket means that already include the reading, so
+ * they are rebuilt instead of extended.
+ */
+window.dash_clientside.clientside.extend_live_graphs = function(live, ids, figures, windowInfo, sensorName) {
+    const noUpdate = window.dash_clientside.no_update;
+    const unchanged = ids.map(() => noUpdate);
+
+    if (!live || !live.measurements || live.sensor !== sensorName || !windowInfo || !windowInfo.live) {
+        return [unchanged, noUpdate];
+    }
+    if (windowInfo.resolution !== "raw") {
+        return [unchanged, Date.now()];
+    }
+
+    const when = new Date(live.timestamp.endsWith("Z") || /[+-]\d\d:\d\d$/.test(live.timestamp)
+        ? live.timestamp : live.timestamp + "Z");
+    const x = toLocalX(when, windowInfo.timezone);
+    const cutoff = toLocalX(new Date(when.getTime() - windowInfo.window_ms), windowInfo.timezone);
+
+    const values = {};
+    live.measurements.forEach(m => {
+        if (!m.is_health && !NOT_GRAPHED.includes(m.name) && m.value !== null) values[m.name] = m.value;
+    });
+
+    let rebuild = false;
+    const graphed = new Set(ids.map(id => id.index));
+    Object.keys(values).forEach(name => { if (!graphed.has(name)) rebuild = true; });
+
+    const updates = ids.map((id, i) => {
+        const value = values[id.index];
+        const plot = plotFor(id);
+        const traces = plot && plot.data ? plot.data : (figures[i] || {}).data;
+        if (value === undefined || !traces || !traces.length) return noUpdate;
+
+        const xs = traces[0].x || [];
+        if (xs.length && String(xs[xs.length - 1]).slice(0, 19) >= x) return noUpdate;  // Already shown
+        const keep = xs.length - firstIndexFrom(xs, cutoff) + 1;
+
+        if (plot) fitYRange(plot, value);
+
+        if (traces.length < 3) {
+            // Sensor just came back online: rebuild to add the Live markers
+            rebuild = true;
+            return [{x: [[x]], y: [[value]]}, [0], keep];
+        }
+        return [
+            {x: [[x], [x], [x]], y: [[value], [value], [value]]},
+            [0, 1, 2],
+            {x: [keep, 1, 1], y: [keep, 1, 1]}
+        ];
+    });
+
+    return [updates, rebuild ? Date.now() : noUpdate];
+};
+
+// Width available to the graphs (they span the full row), for point capping
+window.dash_clientside.clientside.graph_width = function(sensorName) {
+    const row = document.getElementById("multi-sensor-graph");
+    return Math.round((row && row.clientWidth) || window.innerWidth);
+};
@@ -8,25 +8,69 @@ window.dash_clientside.clientside.update_store = function(msg) {
     return msg || window.dash_clientside.no_update;
 };
 
+// Room for the current page: {event: 'join_sensor', data: {...}} or null.
+// The server only sends a sensor's updates to clients in its room.
+let currentRoom = null;
+let socket = null;
+
+function sendRoom() {
+    if (!socket || !socket.connected) return;
+    if (currentRoom) {
+        socket.emit(currentRoom.event, currentRoom.data);
+    } else {
+        socket.emit("leave_rooms");
+    }
+}
+
+// Join the room matching the page: a sensor's dashboard or the fleet map
+window.dash_clientside.clientside.join_page_room = function(pathname, search) {
+    if (pathname === "/dashboard") {
+        const sensor = new URLSearchParams(search || "").get("sensor");
+        currentRoom = sensor ? {event: "join_sensor", data: {sensor: sensor}} : null;
+    } else if (pathname === "/") {
+        currentRoom = {event: "join_fleet", data: {}};
+    } else {
+        currentRoom = null;
+    }
+    sendRoom();
+    return currentRoom ? currentRoom.event : null;
+};
+
+// Fleet updates only refresh the map status, so at most once every 10 s
+const FLEET_REFRESH_MS = 10000;
+let fleetTimer = null;
+let lastFleetRefresh = 0;
+
+function refreshFleet(data) {
+    lastFleetRefresh = Date.now();
+    fleetTimer = null;
+    dash_clientside.set_props("fleet-update", { data: data });
+}
+
 // Initialize Socket
 function initSocket() {
     if (typeof io !== 'undefined') {
-        const socket = io();
+        socket = io();
 
         socket.on("connect", () => {
             console.log("✅ Socket.IO connected");
+            // Rooms are per connection, so rejoin after every (re)connect
+            sendRoom();
         });
 
         socket.on("sensor_update", (data) => {
             console.log("📡 Sensor update received:", data);
             dash_clientside.set_props("live-sensor-data", { data: data });
         });
+
+        socket.on("fleet_update", (data) => {
+            if (fleetTimer) return;
+            const wait = Math.max(0, lastFleetRefresh + FLEET_REFRESH_MS - Date.now());
+            fleetTimer = setTimeout(() => refreshFleet(data), wait);
+        });
     } else {
         setTimeout(initSocket, 100);
     }
 }
 
 initSocket();
-
-
-
@@ -1,6 +1,6 @@
 from dash import callback, Input, Output, State, html, no_update
 import dash_bootstrap_components as dbc
-from server.models import create_or_update_sensor, get_sensor_by_name
+from server.models import create_or_update_sensor, get_sensor_meta
 import time
 from flask import session
 
@@ -25,7 +25,7 @@ def submit_onboarding_form(n_clicks, device_name, latitude, longitude, timezone,
         if not all([device_name, latitude, longitude, device_type]):
             return dbc.Alert("Device name, latitude, longitude, and device type fields are required!", color="danger"), no_update
 
-        existing_sensor = get_sensor_by_name(device_name)
+        existing_sensor = get_sensor_meta(device_name)
         if existing_sensor:
             return dbc.Alert(
                 f"Sensor with name '{device_name}' already exists. Please use another name or update the existing sensor.",
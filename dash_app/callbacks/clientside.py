@@ -1,4 +1,4 @@
-from dash import clientside_callback, ClientsideFunction, Input, Output
+from dash import clientside_callback, ClientsideFunction, Input, Output, State, ALL
 
 # Update Store from WebSocket trigger
 clientside_callback(
@@ -8,4 +8,41 @@ clientside_callback(
     ),
     Output("live-sensor-data", "data"),
     Input("ws-trigger", "children")
-)
\ No newline at end of file
+)
+
+# Join the Socket.IO room for the current page on every navigation
+clientside_callback(
+    ClientsideFunction(
+        namespace="clientside",
+        function_name="join_page_room"
+    ),
+    Output("socket-room", "data"),
+    [Input("main-url", "pathname"),
+     Input("main-url", "search")]
+)
+
+# Append live points to the existing graphs instead of rebuilding them
+clientside_callback(
+    ClientsideFunction(
+        namespace="clientside",
+        function_name="extend_live_graphs"
+    ),
+    [Output({"type": "param-graph", "index": ALL}, "extendData"),
+     Output("graph-refresh", "data")],
+    Input("live-sensor-data", "data"),
+    [State({"type": "param-graph", "index": ALL}, "id"),
+     State({"type": "param-graph", "index": ALL}, "figure"),
+     State("graph-window-store", "data"),
+     State("sensor-name-store", "data")],
+    prevent_initial_call=True
+)
+
+# Graph width in pixels, used to cap the points sent per trace
+clientside_callback(
+    ClientsideFunction(
+        namespace="clientside",
+        function_name="graph_width"
+    ),
+    Output("graph-width-store", "data"),
+    Input("sensor-name-store", "data")
+)
@@ -3,41 +3,55 @@ from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.graph_objs as go
 from datetime import datetime, timedelta
-from server.utils import save_data_to_csv, get_measurement_summary,create_map_markers, get_deployment_statistics
-from server.models import (get_data,
+from flask import current_app
+from server.utils import (get_measurement_summary,
+                          create_map_markers,
+                          get_deployment_statistics,
+                          shape_graph_series)
+from server.models import (get_data_frame,
                            get_sensor_timezone,
-                           get_sensor_by_name,
+                           get_sensor_meta,
+                           get_sensor_image_version,
+                           is_sensor_online,
                            get_most_recent,
-                           get_past_deployments)
+                           get_past_deployments,
+                           choose_resolution)
 import pytz
 from dateutil.parser import parse as parse_date
 import dash_leaflet as dl
+from urllib.parse import quote, urlencode
 
 
 # ----------------------------
 # Time series graphs
 # ----------------------------
+# Full rebuild only when the range, deployment or set of parameters changes.
+# Live uplinks are appended in the browser by extend_live_graphs (live_graphs.js)
 @callback(
-    Output('multi-sensor-graph', 'children'),
+    [Output('multi-sensor-graph', 'children'),
+     Output('graph-window-store', 'data')],
     [
         Input("date-range-radio", "value"),
         Input("historic-date-slider", "value"),
         Input("sensor-name-store", "data"),
         Input("selected-deployment-store", "data"),
-        Input("live-sensor-data", "data")
+        Input("graph-refresh", "data"),
+        Input("graph-width-store", "data")
     ]
 )
-def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data):
+def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, refresh, graph_width):
 
     if not sensor_name:
-        return html.Div("No sensor selected.")
+        return html.Div("No sensor selected."), None
 
-    if deploy_data and not deploy_data.get('is_current', False):
+    is_live = not deploy_data or deploy_data.get('is_current', False)
+    days = {"2-days": 2, "1-week": 7, "1-month": 30, "1-year": 365}.get(radio, 2)
+
+    if not is_live:
         start = datetime.fromtimestamp(slider[0])
         end = datetime.fromtimestamp(slider[1])
     else:
         end = datetime.utcnow()
-        days = {"2-days": 2, "1-week": 7, "1-month": 30, "1-year": 365}.get(radio, 2)
         start = end - timedelta(days=days)
 
         if deploy_data and deploy_data.get('is_current', False):
@@ -48,11 +62,9 @@ def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data
             if start < deploy_start:
                 start = deploy_start
 
-    # Query data with units
-    data = get_data(sensor_name, start, end, lora=False)
-
-    if not data:
-        return html.Div(f"No data available for sensor '{sensor_name}' in the selected date range.")
+    # Query data with units, column-wise. Long ranges read the hourly/daily rollups
+    resolution = choose_resolution(start, end)
+    data = get_data_frame(sensor_name, start, end, lora=False, resolution=resolution)
 
     # Prepare Timezone for Display
     tz_str = get_sensor_timezone(sensor_name)
@@ -60,45 +72,42 @@ def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data
         target_tz = pytz.timezone(tz_str)
     except:
         target_tz = pytz.utc
+        tz_str = "UTC"
+
+    # What the browser needs to append live points: the trailing window, the
+    # display timezone (x values are naive wall-clock strings in that timezone)
+    # and the resolution, as only raw traces can take a reading as a new point
+    window = {
+        "live": is_live,
+        "resolution": resolution,
+        "window_ms": days * 24 * 3600 * 1000,
+        "timezone": target_tz.zone,
+    }
 
-    # Process data
-    parameter_data = {}
-    parameter_units = {}
-
-    for row in data:
-        timestamp, value, parameter_name, unit = row.timestamp, row.value, row.name, row.unit
-        local_ts = timestamp.replace(tzinfo=pytz.utc).astimezone(target_tz)
-        if parameter_name not in parameter_data:
-            if parameter_name == "longitude" or parameter_name == "latitude":
-                continue
-            parameter_data[parameter_name] = {"timestamps": [], "values": []}
-            parameter_units[parameter_name] = unit
-        parameter_data[parameter_name]["timestamps"].append(local_ts)
-        parameter_data[parameter_name]["values"].append(value)
-
-    # Sort data by timestamps for each parameter
-    for parameter, values in parameter_data.items():
-        sorted_data = sorted(
-            zip(values["timestamps"], values["values"]),
-            key=lambda x: x[0]
-        )
-        parameter_data[parameter]["timestamps"], parameter_data[parameter]["values"] = zip(*sorted_data)
+    # Local time, grouped by parameter and capped at about one point per pixel
+    # of graph width. The downsampler keeps the shape and the exact last (Live) point.
+    max_points = min(max(int(graph_width or 1000), 200), current_app.config.get('GRAPH_MAX_POINTS', 2000))
+    parameter_data = shape_graph_series(data, target_tz.zone, max_points,
+                                        current_app.config.get('GRAPH_DOWNSAMPLE_METHOD', 'lttb'))
+
+    if not parameter_data:
+        return html.Div(f"No data available for sensor '{sensor_name}' in the selected date range."), window
+
+    # Check if the last point is older than 2 hours (same for every parameter)
+    sensor = get_sensor_meta(sensor_name)
+    is_active = is_sensor_online(sensor) if sensor else False
 
     # Generate graphs dynamically
     graphs = []
     for parameter, values in parameter_data.items():
-        min_y = min(values["values"])
-        max_y = max(values["values"])
+        min_y = values["values"].min()
+        max_y = values["values"].max()
         y_padding = (max_y - min_y) * 0.2
-        unit = parameter_units[parameter]
+        unit = values["unit"]
 
         # Get the very last point for the "Live" indicator
-        last_time = values["timestamps"][-1]
-        last_val = values["values"][-1]
-
-        # Check if the last point is older than 2 hours
-        sensor = get_sensor_by_name(sensor_name)
-        is_active = sensor.is_online
+        last_time = values["timestamps"][-1:]
+        last_val = values["values"][-1:]
 
         trace_data = []
 
@@ -119,13 +128,13 @@ def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data
         if is_active:
             # Halo (Glow)
             trace_data.append(go.Scatter(
-                x=[last_time], y=[last_val], mode="markers",
+                x=last_time, y=last_val, mode="markers",
                 marker={"color": "rgba(220, 53, 69, 0.3)", "size": 25, "line": {"width": 0}},
                 hoverinfo="skip"
             ))
             # Red Dot
             trace_data.append(go.Scatter(
-                x=[last_time], y=[last_val],
+                x=last_time, y=last_val,
                 mode="markers+text",
                 marker={"color": "#dc3545", "size": 12, "line": {"width": 2, "color": "white"}},
                 hoverinfo="skip",  # The Line tooltip already covers this point.
@@ -139,6 +148,7 @@ def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data
             ))
 
         graph = dcc.Graph(
+            id={"type": "param-graph", "index": parameter},
             figure={
                 "data": trace_data,
                 "layout": go.Layout(
@@ -166,7 +176,7 @@ def update_multi_sensor_graph(radio, slider, sensor_name, deploy_data, live_data
             },
         )
         graphs.append(dbc.Col(graph, xs=12, sm=12, md=12, lg=12))
-    return graphs
+    return graphs, window
 
 # ----------------------------
 # File download
@@ -182,40 +192,35 @@ def toggle_download_data_offcanvas(n_clicks, is_open):
     return is_open
 
 @callback(
-    [Output('confirm-dialog', 'displayed'),
-    Output('confirm-dialog', 'message'),
-    Output('download-dataframe-csv', 'data'),],
-    [Input("set-filename-btn", 'n_clicks'),
-     Input('sensor-name-store', 'data')],
-    [State('date-picker-range', 'start_date'),
-     State('date-picker-range', 'end_date'),
-     State('csv-filename', 'value'),
-     State('radio-data-item', 'value')]
+    Output("set-filename-btn", "href"),
+    [Input('sensor-name-store', 'data'),
+     Input('date-picker-range', 'start_date'),
+     Input('date-picker-range', 'end_date'),
+     Input('csv-filename', 'value'),
+     Input('radio-data-item', 'value'),
+     Input('radio-data-format', 'value'),
+     Input('download-bulk', 'value')]
 )
-def file_download(n_clicks, sensor_name, start_date, end_date, filename, data_type):
-    if n_clicks is None:
-        raise PreventUpdate
-    else:
-        #Convert dates from string to date_time object and set hr/min/sec to get full days
-        start_date = parse_date(start_date).replace(hour=0, minute=0, second=0)
-        end_date = parse_date(end_date).replace(hour=23, minute=59, second=59)
-
-        if not start_date or not end_date:
-            return True, 'Please provide a valid date range and filename.', None
-        if not filename:
-            return True, 'Please provide a valid filename.', None
-
-        if data_type == "   Sensor Data":
-            data = get_data(sensor_name, start_date, end_date, lora=False, localize_input=True)
-        else:
-            data = get_data(sensor_name, start_date, end_date, lora=True, localize_input=True)
-
-        if not data:
-            return True, 'No data found for the given date range.', None
+def update_download_link(sensor_name, start_date, end_date, filename, data_type, data_format, bulk):
+    # The server streams the file; dates are whole days in the sensor's timezone
+    if not sensor_name or not start_date or not end_date:
+        return None
+
+    params = {
+        "start": parse_date(start_date).date().isoformat(),
+        "end": parse_date(end_date).date().isoformat(),
+        "type": "sensor" if data_type == "   Sensor Data" else "lora",
+        "format": data_format or "csv",
+    }
+    if filename:
+        params["filename"] = filename
 
-        saved_csv_file = save_data_to_csv(data, sensor_name)
-        return False, '', dict(content=saved_csv_file, filename=f"{filename}.csv")
-    return False, '', None
+    # One ZIP for every sensor of the same device type
+    sensor = get_sensor_meta(sensor_name)
+    if bulk and sensor and sensor.device_type:
+        params["device_type"] = sensor.device_type
+        return f"/bulk-download?{urlencode(params)}"
+    return f"/download/{quote(sensor_name)}?{urlencode(params)}"
 
 # ----------------------------
 # Sensor health
@@ -321,11 +326,11 @@ def get_sensor_pic(sensor_name):
     if not sensor_name:
         return "/assets/no_image_available.png"
 
-    sensor = get_sensor_by_name(sensor_name)
+    image_version = get_sensor_image_version(sensor_name)
 
-    # If DB has image_data, use it. Else, default.
-    if sensor and sensor.image_data:
-        image_src = sensor.image_data
+    # Browser loads (and caches) the image from the image endpoint. Else, default.
+    if image_version:
+        image_src = f"/sensor-image/{quote(sensor_name)}?size=full&v={image_version}"
     else:
         image_src = "/assets/no_image_available.png"
 
@@ -364,18 +369,27 @@ def update_summary_from_url(sensor_name, live_data, deploy_data):
         location = f"{stats['latitude']}\u00B0N   {stats['longitude']}\u00B0W"
         stat_rows = []
 
-        if stats["averages"]:
-            for avg in stats["averages"]:
-                formatted_unit = f"({avg['unit']})" if avg.get('unit') else ""
-                display_name = f"Avg {avg['parameter'].replace('_', ' ').title()} {formatted_unit}"
+        if stats["parameters"]:
+            for param in stats["parameters"]:
+                formatted_unit = f"({param['unit']})" if param.get('unit') else ""
+                display_name = f"Avg {param['parameter'].replace('_', ' ').title()} {formatted_unit}"
+
+                # Spread under the average: sd, range, median and 5-95% band when known
+                details = [f"sd {param['stddev']:.1f}", f"min {param['min']:.1f}", f"max {param['max']:.1f}"]
+                if param.get('median') is not None:
+                    details.append(f"median {param['median']:.1f}")
+                    details.append(f"5-95% {param['p05']:.1f}-{param['p95']:.1f}")
+                details.append(f"n {param['count']:,}")
 
                 # Matches the Live View format exactly could refactor this later
                 stat_rows.append(
                     dbc.Row(
                         [
                             dbc.Col(html.Div(display_name, style={'text-align': 'left', 'font-size': '14px'}), width=9),
-                            dbc.Col(html.Div(f"{round(avg['value'], 1)}",
+                            dbc.Col(html.Div(f"{round(param['mean'], 1)}",
                                              style={'text-align': 'right', 'font-size': '14px'}), width=3),
+                            dbc.Col(html.Small(" \u00B7 ".join(details), className="text-muted"),
+                                    width=12, style={'font-size': '12px', 'margin-bottom': '4px'}),
                         ]
                     )
                 )
@@ -607,7 +621,7 @@ def update_map_view(deploy_data, sensor_name):
     if lat is None or lon is None:
         return no_update, no_update
 
-    sensor = get_sensor_by_name(sensor_name)
+    sensor = get_sensor_meta(sensor_name)
     s_type = sensor.device_type if sensor else None
 
     if s_type == "tide_gauge":
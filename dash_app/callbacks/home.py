@@ -14,9 +14,10 @@ def toggle_card(n, is_open):
 
 @callback(
     Output("map-markers", "children"),
-    Input("show-inactive-switch", "value"),
+    [Input("show-inactive-switch", "value"),
+     Input("fleet-update", "data")],  # Sensor came online (throttled in socket.js)
     prevent_initial_call=True
 )
-def toggle_inactive_sensors(show_inactive):
+def toggle_inactive_sensors(show_inactive, fleet_update):
     markers, _, _ = create_map_markers(show_inactive=show_inactive)
     return markers
\ No newline at end of file
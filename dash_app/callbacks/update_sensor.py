@@ -1,5 +1,5 @@
 from dash import callback, Input, Output, State, callback_context
-from server.models import get_sensor_by_name, create_or_update_sensor, get_all_sensors
+from server.models import get_sensor_meta, create_or_update_sensor, get_all_sensors
 import dash_bootstrap_components as dbc
 
 @callback(
@@ -34,7 +34,7 @@ def show_form_on_device_select(selected_device):
 def populate_form_with_device_info(selected_device):
     if selected_device:
         # Get the sensor details from the database
-        sensor = get_sensor_by_name(selected_device)
+        sensor = get_sensor_meta(selected_device)
 
         btn_text = "Deactivate" if sensor.active else "Reactivate"
         btn_color = "danger" if sensor.active else "success"
@@ -62,7 +62,7 @@ def update_sensor_information(submit_clicks, deactivate_clicks, original_name, n
 
     button_id = ctx.triggered[0]['prop_id'].split('.')[0]
 
-    sensor_to_update = get_sensor_by_name(original_name)
+    sensor_to_update = get_sensor_meta(original_name)
 
     if not sensor_to_update:
         return dbc.Alert(f"Error: Could not find sensor '{original_name}' in the database.", color="danger")
@@ -8,6 +8,7 @@ def get_layout():
         children=[
             dcc.Location(id="main-url", refresh=False),
             dcc.Store(id="sensor-update"),
+            dcc.Store(id="socket-room"),
             html.Div(id="ws-trigger", style={"display": "none"}),
             create_menu(),
             dash.page_container,
@@ -20,6 +20,9 @@ def layout(sensor=None, **other_unknown_query_strings):
     layout = dbc.Container([
         dcc.Store(id="sensor-name-store", data=sensor),
         dcc.Store(id="live-sensor-data"),
+        dcc.Store(id="graph-window-store"),
+        dcc.Store(id="graph-refresh"),
+        dcc.Store(id="graph-width-store"),
         dcc.Store(id="selected-deployment-store", data=None),
 
         # First Row (Map and Info Box)
@@ -123,21 +126,34 @@ def layout(sensor=None, **other_unknown_query_strings):
                                     end_date=cst_today,
                                     stay_open_on_select=True,
                                 ),
+                                html.P("Format"),
+                                dcc.RadioItems(
+                                    [
+                                        {"label": "   CSV", "value": "csv"},
+                                        {"label": "   Parquet", "value": "parquet"},
+                                        {"label": "   Arrow (Feather)", "value": "arrow"},
+                                    ],
+                                    "csv",
+                                    id="radio-data-format",
+                                    className="radio-items"
+                                ),
+                                dcc.Checklist(
+                                    [{"label": "   All sensors of this type (ZIP)", "value": "bulk"}],
+                                    [],
+                                    id="download-bulk",
+                                    className="radio-items"
+                                ),
                                 html.P("File Name", className="file-name-label"),
                                 dbc.Input(
                                     id="csv-filename",
-                                    placeholder="Enter CSV filename",
+                                    placeholder="Enter filename",
                                     className="filename-input"
                                 ),
+                                # Link to the streaming /download route, kept current by update_download_link
                                 dbc.Button(
-                                    "Download CSV", id="set-filename-btn", size="sm", color="primary",
-                                    className="download-csv-btn"
+                                    "Download", id="set-filename-btn", size="sm", color="primary",
+                                    className="download-csv-btn", external_link=True
                                 ),
-                                dcc.Download(id="download-dataframe-csv"),
-                                dcc.ConfirmDialog(
-                                    id='confirm-dialog',
-                                    message=''
-                                )
                             ]),
                             id="download-data-offcanvas",
                             title="Download Options",
@@ -1,5 +1,5 @@
 import dash
-from dash import html
+from dash import dcc, html
 import dash_leaflet as dl
 from server.utils import create_instructions_card,create_map_markers
 
@@ -12,6 +12,7 @@ def layout():
 
     return html.Div(
         [
+            dcc.Store(id="fleet-update"),
             dl.Map(
                 [
                     dl.TileLayer(url="https://{s}.basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}{r}.png"),
@@ -1,9 +1,34 @@
-from flask import Flask, session
+from flask import Flask, session, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import time
 from .database import db, init_db
 from .routes import setup_routes
 import os
 from datetime import timedelta
 from .socketio import socketio
+from .ingest import ingest_queue
+from .cache import data_cache
+from .models import migrate_legacy_images
+from .rollups import backfill_latest
+from .spool import spool
+from .parser import load_iridium_layouts
+from .commands import register_commands
+from . import partitions
+from .metrics import HTTP_REQUEST_SECONDS, HTTP_REQUEST_DB_QUERIES
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_db_queries(conn, cursor, statement, parameters, context, executemany):
+    # Database round trips for the current request, reported in /metrics
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+
+def describe_request():
+    """Endpoint name, or the callback outputs for Dash callback requests."""
+    if request.path.endswith('/_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        return f"Dash callback {body.get('output', '?')}"
+    return request.endpoint or request.path
 
 def create_server():
 
@@ -15,17 +40,106 @@ def create_server():
     server.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
     server.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
+    # Ingest configuration. 'sync' commits inside the request,
+    # 'queue' hands uplinks to a background writer that commits in groups,
+    # 'spool' appends uplinks to a local file that a replay worker drains.
+    server.config['INGEST_MODE'] = os.environ.get("INGEST_MODE", "sync")
+    server.config['INGEST_GROUP_MAX_UPLINKS'] = int(os.environ.get("INGEST_GROUP_MAX_UPLINKS", 500))
+    server.config['INGEST_GROUP_MAX_MS'] = int(os.environ.get("INGEST_GROUP_MAX_MS", 200))
+    server.config['INGEST_SPOOL_PATH'] = os.environ.get(
+        "INGEST_SPOOL_PATH", os.path.join(server.instance_path, "ingest.spool"))
+
+    # Monthly sensor_data partitions kept ahead of time (Postgres, once converted)
+    server.config['SENSOR_DATA_PARTITIONS_AHEAD'] = int(os.environ.get("SENSOR_DATA_PARTITIONS_AHEAD", 3))
+
+    # Parquet files of archived deployments (see server/archive.py)
+    server.config['ARCHIVE_DIR'] = os.environ.get(
+        "ARCHIVE_DIR", os.path.join(server.instance_path, "archive"))
+
+    # Graph traces are downsampled to about one point per pixel, capped here.
+    # 'lttb' keeps the shape, 'minmax' keeps every spike.
+    server.config['GRAPH_MAX_POINTS'] = int(os.environ.get("GRAPH_MAX_POINTS", 2000))
+    server.config['GRAPH_DOWNSAMPLE_METHOD'] = os.environ.get("GRAPH_DOWNSAMPLE_METHOD", "lttb")
+
+    # In debug mode, requests (Dash callbacks included) issuing more queries
+    # than this are logged. 0 turns the warning off.
+    server.config['DB_QUERY_WARN_THRESHOLD'] = int(os.environ.get("DB_QUERY_WARN_THRESHOLD", 20))
+
+    # Largest JSON array accepted by /receive_data/batch
+    server.config['INGEST_BATCH_MAX_ITEMS'] = int(os.environ.get("INGEST_BATCH_MAX_ITEMS", 5000))
+
+    # Per-sensor files built in parallel by /bulk-download
+    server.config['BULK_EXPORT_WORKERS'] = int(os.environ.get("BULK_EXPORT_WORKERS", 4))
+
+    # Largest ?limit accepted by /api/sensors/<name>/data
+    server.config['API_MAX_PAGE_SIZE'] = int(os.environ.get("API_MAX_PAGE_SIZE", 10000))
+
+    # get_data result cache (server/cache.py). 0 MB turns it off. Buckets still
+    # open to ingest expire after DATA_CACHE_OPEN_TTL seconds, so writes made
+    # by other worker processes show up; older buckets after
+    # DATA_CACHE_SETTLED_TTL seconds (0: never), so rollup rebuilds and dedupes
+    # run from the CLI show up without a restart.
+    server.config['DATA_CACHE_MAX_MB'] = int(os.environ.get("DATA_CACHE_MAX_MB", 256))
+    server.config['DATA_CACHE_OPEN_TTL'] = int(os.environ.get("DATA_CACHE_OPEN_TTL", 30))
+    server.config['DATA_CACHE_SETTLED_TTL'] = int(os.environ.get("DATA_CACHE_SETTLED_TTL", 900))
+    data_cache.max_bytes = server.config['DATA_CACHE_MAX_MB'] * 1024 * 1024
+    data_cache.open_ttl_seconds = server.config['DATA_CACHE_OPEN_TTL']
+    data_cache.settled_ttl_seconds = server.config['DATA_CACHE_SETTLED_TTL']
+
+    # Optional JSON file with extra Iridium payload layouts (see server/parser.py)
+    if os.environ.get("IRIDIUM_LAYOUTS_FILE"):
+        load_iridium_layouts(os.environ["IRIDIUM_LAYOUTS_FILE"])
+
     socketio.init_app(server)
 
     @server.before_request
     def before_request():
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
         if 'user_logged_in' not in session:
             session['user_logged_in'] = False  # Initialize to False when first visiting the site
         session.permanent = True  # Enable session permanence
 
+    @server.after_request
+    def after_request(response):
+        if 'request_started' in g:
+            endpoint = request.endpoint or 'unknown'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, endpoint)
+            HTTP_REQUEST_DB_QUERIES.observe(g.db_queries, endpoint)
+
+            threshold = server.config['DB_QUERY_WARN_THRESHOLD']
+            if server.debug and threshold and g.db_queries > threshold:
+                print(f"{describe_request()} issued {g.db_queries} queries (threshold {threshold})")
+        return response
+
     init_db(server)
     
     with server.app_context():
         setup_routes(server)
 
+        # Photos still in the legacy sensors.image_data column are resized
+        # into sensor_images once, so they show up without a manual step
+        migrated = [name for name, ok in migrate_legacy_images() if ok]
+        if migrated:
+            print(f"Migrated legacy images for {len(migrated)} sensors.")
+
+        # First start after upgrading: current readings and last-seen times
+        filled = backfill_latest()
+        if filled:
+            print(f"Filled sensor_latest for {filled} sensors.")
+
+    register_commands(server)
+
+    if (server.config['SQLALCHEMY_DATABASE_URI'] or '').startswith('postgres'):
+        partitions.start_maintenance(server, server.config['SENSOR_DATA_PARTITIONS_AHEAD'])
+
+    if server.config['INGEST_MODE'] == 'queue':
+        ingest_queue.max_group = server.config['INGEST_GROUP_MAX_UPLINKS']
+        ingest_queue.max_wait_ms = server.config['INGEST_GROUP_MAX_MS']
+        ingest_queue.start(server)
+    elif server.config['INGEST_MODE'] == 'spool':
+        spool.open(server.config['INGEST_SPOOL_PATH'])
+        spool.max_group = server.config['INGEST_GROUP_MAX_UPLINKS']
+        spool.start(server)
+
     return server
@@ -0,0 +1,239 @@
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from flask import current_app
+from werkzeug.utils import secure_filename
+from sqlalchemy import delete
+from .database import db
+from .models import SensorData, Sensor, Parameter, LocationHistory, ArchivedRange, PERCENTILES, get_deployment_stats
+from .partitions import month_start, next_month
+
+# Cold storage for raw SensorData of closed deployments.
+#
+# Rows are moved to ARCHIVE_DIR/<id>-<sensor>/<YYYY-MM>.parquet (zstd) and the
+# archived spans recorded in ArchivedRange; get_data and the deployment
+# statistics read those spans back through memory-mapped Arrow and merge them
+# with the rows still in the database. Rollups and sensor_latest are left in
+# place, so hourly/daily views never touch the files.
+
+SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us')),
+    ('parameter_id', pa.int32()),
+    ('value', pa.float64()),
+])
+
+# Same fields as the rows get_data returns from the database
+ArchivedRow = namedtuple('ArchivedRow', ['timestamp', 'value', 'name', 'unit'])
+
+
+def archive_dir():
+    return current_app.config['ARCHIVE_DIR']
+
+def month_path(sensor, month):
+    """
+    File of one sensor month, relative to ARCHIVE_DIR. The directory is built
+    from the sensor id and a sanitized name, so names with '/' or '..' stay
+    inside ARCHIVE_DIR.
+    """
+    return os.path.join(f"{sensor.id}-{secure_filename(sensor.name) or 'sensor'}", f"{month:%Y-%m}.parquet")
+
+
+# ----------------
+# Writing
+#-----------------
+def _write_month(path, table, start, end):
+    """
+    Writes table into a monthly file, replacing any rows the file already has
+    in [start, end) so re-running an interrupted archive never duplicates.
+    The file is replaced atomically.
+    """
+    full_path = os.path.join(archive_dir(), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    if os.path.exists(full_path):
+        existing = pq.read_table(full_path, memory_map=True)
+        timestamps = existing['timestamp']
+        outside = pc.or_(pc.less(timestamps, pa.scalar(start, SCHEMA.field('timestamp').type)),
+                         pc.greater_equal(timestamps, pa.scalar(end, SCHEMA.field('timestamp').type)))
+        table = pa.concat_tables([existing.filter(outside), table])
+
+    table = table.sort_by([('timestamp', 'ascending'), ('parameter_id', 'ascending')])
+    tmp_path = full_path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, full_path)
+
+def archive_range(sensor, start, end):
+    """
+    Moves a sensor's raw rows in [start, end) to Parquet, one file per month,
+    then records the ranges and deletes the rows in one transaction.
+    Returns the number of rows archived.
+    """
+    ranges = []
+    month = month_start(start)
+    while month < end:
+        chunk_start, chunk_end = max(start, month), min(end, next_month(month))
+        rows = (
+            db.session.query(SensorData.timestamp, SensorData.parameter_id, SensorData.value)
+            .filter(SensorData.sensor_id == sensor.id)
+            .filter(SensorData.timestamp >= chunk_start)
+            .filter(SensorData.timestamp < chunk_end)
+            .all()
+        )
+        if rows:
+            timestamps, parameter_ids, values = zip(*rows)
+            table = pa.table([list(timestamps), list(parameter_ids), list(values)], schema=SCHEMA)
+            path = month_path(sensor, month)
+            _write_month(path, table, chunk_start, chunk_end)
+            ranges.append((chunk_start, chunk_end, path, len(rows)))
+        month = next_month(month)
+
+    if not ranges:
+        return 0
+
+    try:
+        for chunk_start, chunk_end, path, row_count in ranges:
+            db.session.add(ArchivedRange(sensor_id=sensor.id, start=chunk_start, end=chunk_end,
+                                         path=path, row_count=row_count))
+        db.session.execute(
+            delete(SensorData)
+            .where(SensorData.sensor_id == sensor.id)
+            .where(SensorData.timestamp >= start)
+            .where(SensorData.timestamp < end)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return sum(r[3] for r in ranges)
+
+def archive_closed_deployments(older_than_days):
+    """
+    Archives every deployment that ended more than older_than_days ago and
+    has not been archived yet, storing its deployment statistics first.
+    Returns [(sensor name, start, end, rows)].
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deployments = (
+        db.session.query(LocationHistory, Sensor)
+        .join(Sensor, LocationHistory.sensor_id == Sensor.id)
+        .filter(LocationHistory.removed_at.isnot(None))
+        .filter(LocationHistory.removed_at < cutoff)
+        .order_by(LocationHistory.deployed_at)
+        .all()
+    )
+
+    archived = []
+    for history, sensor in deployments:
+        already = db.session.query(ArchivedRange.id) \
+            .filter(ArchivedRange.sensor_id == sensor.id) \
+            .filter(ArchivedRange.start < history.removed_at) \
+            .filter(ArchivedRange.end > history.deployed_at) \
+            .first()
+        if already:
+            continue
+
+        # Stored while every raw row is still in one place, so the percentiles are exact
+        get_deployment_stats(sensor.name, history.deployed_at, history.removed_at, deployment_id=history.id)
+        rows = archive_range(sensor, history.deployed_at, history.removed_at)
+        archived.append((sensor.name, history.deployed_at, history.removed_at, rows))
+    return archived
+
+
+# ----------------
+# Reading
+#-----------------
+def read_archived(sensor_id, start, end, include_ids=None, exclude_ids=None, end_inclusive=True):
+    """
+    Archived rows of one sensor between start and end as an Arrow table
+    (timestamp, parameter_id, value) sorted by timestamp, or None when no
+    archived range overlaps. Files are memory-mapped and only the row groups
+    matching the filters are read.
+    """
+    if include_ids is not None and not include_ids:
+        return None
+
+    ranges = (
+        db.session.query(ArchivedRange.path)
+        .filter(ArchivedRange.sensor_id == sensor_id)
+        .filter(ArchivedRange.start <= end)
+        .filter(ArchivedRange.end > start)
+        .distinct()
+        .all()
+    )
+    if not ranges:
+        return None
+
+    filters = [('timestamp', '>=', start), ('timestamp', '<=' if end_inclusive else '<', end)]
+    if include_ids is not None:
+        filters.append(('parameter_id', 'in', list(include_ids)))
+    if exclude_ids:
+        filters.append(('parameter_id', 'not in', list(exclude_ids)))
+
+    tables = []
+    for (path,) in sorted(ranges):
+        full_path = os.path.join(archive_dir(), path)
+        try:
+            tables.append(pq.read_table(full_path, memory_map=True, filters=filters, schema=SCHEMA))
+        except FileNotFoundError:
+            print(f"Archive file missing: {full_path}")
+
+    if not tables:
+        return None
+    return pa.concat_tables(tables).sort_by('timestamp')
+
+def _parameter_info(table):
+    """{parameter_id: (name, unit)} for the parameters in an archived table."""
+    parameter_ids = pc.unique(table['parameter_id']).to_pylist()
+    return {
+        row.id: (row.name, row.canonical_unit)
+        for row in db.session.query(Parameter.id, Parameter.name, Parameter.canonical_unit)
+        .filter(Parameter.id.in_(parameter_ids)).all()
+    }
+
+def iter_archived_rows(sensor_id, start, end, include_ids=None, exclude_ids=None, batch_size=10000,
+                       end_inclusive=True):
+    """
+    Archived rows in the same (timestamp, value, name, unit) shape as get_data,
+    converted to Python objects one record batch at a time.
+    """
+    table = read_archived(sensor_id, start, end, include_ids, exclude_ids, end_inclusive)
+    if table is None or table.num_rows == 0:
+        return
+
+    params = _parameter_info(table)
+    for batch in table.to_batches(max_chunksize=batch_size):
+        columns = batch.to_pydict()
+        for timestamp, parameter_id, value in zip(columns['timestamp'], columns['parameter_id'], columns['value']):
+            yield ArchivedRow(timestamp, value, *params.get(parameter_id, (str(parameter_id), '')))
+
+def get_archived_rows(sensor_id, start, end, include_ids=None, exclude_ids=None, end_inclusive=True):
+    """Archived rows in the same (timestamp, value, name, unit) shape as get_data."""
+    return list(iter_archived_rows(sensor_id, start, end, include_ids, exclude_ids,
+                                   end_inclusive=end_inclusive))
+
+def get_archived_stats(sensor_id, start, end, exclude_ids=None):
+    """
+    {parameter_id: [count, mean, m2, min, max, percentiles]} over archived
+    rows, the shape get_deployment_stats merges. Percentiles are t-digest
+    estimates of PERCENTILES.
+    """
+    table = read_archived(sensor_id, start, end, exclude_ids=exclude_ids)
+    if table is None or table.num_rows == 0:
+        return {}
+
+    grouped = table.group_by('parameter_id').aggregate([
+        ('value', 'count'), ('value', 'mean'), ('value', 'variance', pc.VarianceOptions(ddof=0)),
+        ('value', 'min'), ('value', 'max'), ('value', 'tdigest', pc.TDigestOptions(q=list(PERCENTILES))),
+    ]).to_pydict()
+    return {
+        parameter_id: [count, mean, variance * count, low, high, percentiles]
+        for parameter_id, count, mean, variance, low, high, percentiles in zip(
+            grouped['parameter_id'], grouped['value_count'], grouped['value_mean'], grouped['value_variance'],
+            grouped['value_min'], grouped['value_max'], grouped['value_tdigest'])
+    }
@@ -0,0 +1,395 @@
+import bisect
+import functools
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+from flask import g, has_request_context
+from sqlalchemy import event, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .database import db, dialect_insert
+
+# In-process caches for hot lookups. Models are imported inside methods
+# because server.models imports this module.
+
+ParamInfo = namedtuple('ParamInfo', ['id', 'name', 'canonical_unit'])
+
+
+class ParameterRegistry:
+    """
+    Process-wide map of parameter name -> (id, canonical_unit).
+
+    Loaded with one query on first use and refreshed periodically so parameters
+    created by other workers show up. Parameters are never renamed or deleted,
+    so a cached entry can not go stale.
+    """
+
+    def __init__(self, refresh_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self._by_name = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        from server.models import Parameter
+        rows = db.session.query(Parameter.id, Parameter.name, Parameter.canonical_unit).all()
+        with self._lock:
+            self._by_name = {row.name: ParamInfo(row.id, row.name, row.canonical_unit) for row in rows}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            self.load()
+
+    def get(self, name):
+        """Returns the ParamInfo for name, or None if the parameter does not exist."""
+        self._ensure_loaded()
+        info = self._by_name.get(name)
+        if info is None:
+            info = self._fetch(name)
+        return info
+
+    def get_or_create(self, name, canonical_unit=''):
+        """
+        Returns the ParamInfo for name, creating the parameter if needed.
+
+        Creation is an upsert (ON CONFLICT DO NOTHING) committed on its own
+        connection, so concurrent writers never collide on the unique name and
+        the caller's ingest transaction is left untouched.
+        """
+        info = self.get(name)
+        if info is not None:
+            return info
+
+        from server.models import Parameter
+        stmt = dialect_insert(Parameter.__table__)
+        with db.engine.begin() as conn:
+            if stmt is not None:
+                conn.execute(stmt.values(name=name, canonical_unit=canonical_unit)
+                             .on_conflict_do_nothing(index_elements=['name']))
+            else:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(Parameter.__table__).values(name=name, canonical_unit=canonical_unit))
+                except IntegrityError:
+                    pass  # Another writer created it first
+
+        return self._fetch(name)
+
+    def _fetch(self, name):
+        from server.models import Parameter
+        row = db.session.query(Parameter.id, Parameter.name, Parameter.canonical_unit) \
+            .filter(Parameter.name == name).first()
+        if row is None:
+            return None
+        info = ParamInfo(row.id, row.name, row.canonical_unit)
+        with self._lock:
+            self._by_name[name] = info
+        return info
+
+    def ids_for(self, names):
+        """Ids of the parameters in names that exist."""
+        self._ensure_loaded()
+        return [self._by_name[n].id for n in names if n in self._by_name]
+
+
+parameter_registry = ParameterRegistry()
+
+
+SensorMeta = namedtuple('SensorMeta', ['id', 'name', 'device_type', 'latitude', 'longitude', 'timezone', 'active'])
+
+
+class SensorCache:
+    """
+    Process-wide cache of sensor metadata, without the image column.
+
+    Every change bumps the version through invalidate(); readers reload the
+    whole (small) sensors table when their loaded version is behind. Other
+    workers are not notified, so entries also expire after ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds=60, miss_reload_seconds=5):
+        self.ttl_seconds = ttl_seconds
+        self.miss_reload_seconds = miss_reload_seconds
+        self.version = 0
+        self._by_name = {}
+        self._loaded_version = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def load(self):
+        from server.models import Sensor
+        version = self.version
+        rows = db.session.query(
+            Sensor.id, Sensor.name, Sensor.device_type, Sensor.latitude,
+            Sensor.longitude, Sensor.timezone, Sensor.active
+        ).all()
+        with self._lock:
+            self._by_name = {row.name: SensorMeta(*row) for row in rows}
+            self._loaded_version = version
+            self._loaded_at = time.monotonic()
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception as e:
+            # Keep serving the last good copy while the database is unreachable,
+            # and wait another ttl before retrying
+            if self._loaded_at is None:
+                raise
+            db.session.rollback()
+            self._loaded_version = self.version
+            self._loaded_at = time.monotonic()
+            print(f"Sensor cache reload failed, using stale entries: {e}")
+
+    def _ensure_loaded(self):
+        if (self._loaded_version != self.version
+                or time.monotonic() - self._loaded_at > self.ttl_seconds):
+            self._reload()
+
+    def get(self, name):
+        """Returns the SensorMeta for name, or None if no such sensor."""
+        self._ensure_loaded()
+        meta = self._by_name.get(name)
+        if meta is None and name and time.monotonic() - self._loaded_at > self.miss_reload_seconds:
+            # May have been onboarded through another worker since our last load
+            self._reload()
+            meta = self._by_name.get(name)
+        return meta
+
+    def all(self):
+        self._ensure_loaded()
+        return list(self._by_name.values())
+
+
+sensor_cache = SensorCache()
+
+
+class RecentKeys:
+    """Bounded set of recently seen keys; the oldest are evicted first."""
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+
+
+def request_memo(func):
+    """
+    Memoizes a read helper for the current request: repeated calls with the
+    same arguments within one Flask request (a page render, or a single Dash
+    callback such as a per-parameter loop) query once. Each Dash callback is
+    a separate request with its own memo, so two callbacks calling the same
+    helper still query once each; nothing is shared between requests.
+
+    Results are shared between callers in the request and must not be
+    mutated. Outside a request (ingest workers, CLI commands) the helper runs
+    uncached, and the memo is dropped on every commit so reads after a write
+    see the change.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not has_request_context():
+            return func(*args, **kwargs)
+
+        memo = g.setdefault('request_memo', {})
+        key = (func.__qualname__, args, tuple(sorted(kwargs.items())))
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return func(*args, **kwargs)  # Unhashable arguments
+
+        result = memo[key] = func(*args, **kwargs)
+        return result
+
+    return wrapper
+
+@event.listens_for(Session, "after_commit")
+def clear_request_memo(session):
+    if has_request_context():
+        g.pop('request_memo', None)
+
+
+class DataCache:
+    """
+    Process-wide LRU cache of get_data rows.
+
+    Rows are cached per (sensor, lora, resolution, time bucket), with buckets
+    aligned to fixed spans so sliding windows like now-30d..now reuse the
+    same entries and only query the buckets they have not seen. A window is
+    served from whole buckets, sliced at its two ends.
+
+    Buckets that ended before the settle period only change through
+    maintenance commands run in another process (`flask rebuild-rollups`,
+    `flask dedupe-sensor-data`), so they expire after settled_ttl_seconds
+    (0: never). The open head bucket (and any bucket that ingest writes into)
+    is dropped by invalidate() after each ingest commit in this process, and
+    expires after open_ttl_seconds for ingest done by other workers.
+    Memory is capped by an estimate of ROW_BYTES per cached row.
+    """
+
+    BUCKET_SPANS = {
+        'raw': timedelta(days=1),
+        'hourly': timedelta(days=7),
+        'daily': timedelta(days=91),
+    }
+    ROW_BYTES = 160
+    ENTRY_BYTES = 200
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, open_ttl_seconds=30, settled_ttl_seconds=900,
+                 settle_seconds=600):
+        self.max_bytes = max_bytes
+        self.open_ttl_seconds = open_ttl_seconds
+        self.settled_ttl_seconds = settled_ttl_seconds
+        self.settle_seconds = settle_seconds
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._entries = OrderedDict()  # key -> (timestamps, rows, size, expires_at or None)
+        self._versions = {}            # sensor id -> invalidation count
+        self._lock = threading.Lock()
+
+    def bucket_start(self, timestamp, resolution):
+        span = self.BUCKET_SPANS[resolution]
+        return timestamp - (timestamp - self.EPOCH) % span
+
+    def get_rows(self, sensor_id, lora, resolution, start_date, end_date, fetch):
+        """
+        Rows with start_date <= timestamp <= end_date (naive UTC), ordered by
+        timestamp. fetch(start, end) must return the rows of [start, end)
+        ordered by timestamp; it runs once per run of consecutive missing
+        buckets.
+        """
+        if not self.max_bytes:
+            return [row for row in fetch(start_date, end_date + timedelta(microseconds=1))]
+
+        span = self.BUCKET_SPANS[resolution]
+        buckets = []
+        bucket = self.bucket_start(start_date, resolution)
+        while bucket <= end_date:
+            buckets.append(bucket)
+            bucket += span
+
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for bucket in buckets:
+                key = (sensor_id, lora, resolution, bucket)
+                entry = self._entries.get(key)
+                if entry is not None and (entry[3] is None or entry[3] > now):
+                    self._entries.move_to_end(key)
+                    found[bucket] = entry
+                    self.stats["hits"] += 1
+                else:
+                    missing.append(bucket)
+                    self.stats["misses"] += 1
+            version = self._versions.get(sensor_id, 0)
+
+        # One query per run of consecutive missing buckets
+        runs = []
+        for bucket in missing:
+            if runs and runs[-1][-1] + span == bucket:
+                runs[-1].append(bucket)
+            else:
+                runs.append([bucket])
+        for run in runs:
+            rows = list(fetch(run[0], run[-1] + span))
+            timestamps = [row.timestamp for row in rows]
+            for bucket in run:
+                lo = bisect.bisect_left(timestamps, bucket)
+                hi = bisect.bisect_left(timestamps, bucket + span)
+                found[bucket] = self._store((sensor_id, lora, resolution, bucket), version,
+                                            timestamps[lo:hi], rows[lo:hi], bucket + span)
+
+        results = []
+        for bucket in buckets:
+            timestamps, rows = found[bucket][0], found[bucket][1]
+            if bucket >= start_date and bucket + span <= end_date:
+                results.extend(rows)
+            else:
+                lo = bisect.bisect_left(timestamps, start_date)
+                hi = bisect.bisect_right(timestamps, end_date)
+                results.extend(rows[lo:hi])
+        return results
+
+    def _store(self, key, version, timestamps, rows, bucket_end):
+        size = self.ENTRY_BYTES + len(rows) * self.ROW_BYTES
+        expires_at = None
+        if bucket_end > datetime.utcnow() - timedelta(seconds=self.settle_seconds):
+            expires_at = time.monotonic() + self.open_ttl_seconds
+        elif self.settled_ttl_seconds:
+            expires_at = time.monotonic() + self.settled_ttl_seconds
+        entry = (timestamps, rows, size, expires_at)
+
+        with self._lock:
+            # Ingest committed for this sensor while we were reading: serve the
+            # rows but do not keep them, they may already be stale
+            if self._versions.get(key[0], 0) != version or size > self.max_bytes:
+                return entry
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[2]
+                self.stats["evictions"] += 1
+        return entry
+
+    def invalidate(self, rows):
+        """
+        Drops the buckets that newly committed SensorData rows fall in.
+
+        Args:
+            rows (list): (sensor_id, parameter_id, timestamp, value) tuples.
+        """
+        touched = {(row[0], row[2]) for row in rows}
+        with self._lock:
+            for sensor_id in {sensor_id for sensor_id, _ in touched}:
+                self._versions[sensor_id] = self._versions.get(sensor_id, 0) + 1
+            for sensor_id, timestamp in touched:
+                for resolution in self.BUCKET_SPANS:
+                    bucket = self.bucket_start(timestamp, resolution)
+                    for lora in (False, True):
+                        entry = self._entries.pop((sensor_id, lora, resolution, bucket), None)
+                        if entry is not None:
+                            self.bytes -= entry[2]
+                            self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else None
+        return stats
+
+
+data_cache = DataCache()
@@ -0,0 +1,156 @@
+import click
+from sqlalchemy import text
+from .database import db
+
+# Running servers cache get_data results (server/cache.py)
+CACHE_NOTE = ("Running servers show the change once their cached data expires "
+              "(DATA_CACHE_SETTLED_TTL, 15 minutes by default); restart them to see it now.")
+
+def register_commands(server):
+    """Maintenance commands, run with `flask --app run <command>`."""
+
+    @server.cli.command('dedupe-sensor-data')
+    def dedupe_sensor_data():
+        """
+        Removes duplicate SensorData rows (same sensor, parameter and timestamp),
+        keeping the first one stored, then makes idx_sensor_param_time unique.
+        """
+        result = db.session.execute(text("""
+            DELETE FROM sensor_data
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM sensor_data
+                GROUP BY sensor_id, parameter_id, timestamp
+            )
+        """))
+        click.echo(f"Removed {result.rowcount} duplicate rows.")
+
+        db.session.execute(text("DROP INDEX IF EXISTS idx_sensor_param_time"))
+        db.session.execute(text(
+            "CREATE UNIQUE INDEX idx_sensor_param_time ON sensor_data (sensor_id, parameter_id, timestamp)"
+        ))
+        db.session.commit()
+        click.echo("idx_sensor_param_time is now unique. Restart the server to use it for ingest.")
+        click.echo(CACHE_NOTE)
+
+    def rebuild_per_sensor(rebuild, sensor_name, label):
+        """Runs rebuild(sensor_id) for one or all sensors, one transaction each."""
+        from .models import Sensor
+
+        query = db.session.query(Sensor.id, Sensor.name)
+        if sensor_name:
+            query = query.filter(Sensor.name == sensor_name)
+        sensors = query.all()
+        if not sensors:
+            click.echo("No matching sensors.")
+            return
+
+        for sensor_id, name in sensors:
+            rebuild(sensor_id)
+            db.session.commit()
+            click.echo(f"Rebuilt {label} for {name}.")
+
+    @server.cli.command('rebuild-rollups')
+    @click.option('--sensor', 'sensor_name', default=None, help='Only rebuild this sensor.')
+    def rebuild_rollups_command(sensor_name):
+        """
+        Recomputes the hourly and daily rollups from sensor_data, one sensor per
+        transaction. Run once after upgrading, or after editing raw rows.
+        """
+        from .rollups import rebuild_rollups
+        rebuild_per_sensor(rebuild_rollups, sensor_name, "rollups")
+        click.echo(CACHE_NOTE)
+
+    @server.cli.command('rebuild-latest')
+    @click.option('--sensor', 'sensor_name', default=None, help='Only rebuild this sensor.')
+    def rebuild_latest_command(sensor_name):
+        """
+        Recomputes sensor_latest (current values and last-seen) from sensor_data.
+        The server fills an empty sensor_latest at startup; run this after
+        editing raw rows.
+        """
+        from .rollups import rebuild_latest
+        rebuild_per_sensor(rebuild_latest, sensor_name, "latest values")
+
+    @server.cli.command('partition-sensor-data')
+    @click.option('--months-ahead', default=3, show_default=True, help='Future months to create.')
+    def partition_sensor_data(months_ahead):
+        """
+        Converts sensor_data to monthly range partitions (Postgres only).
+        Copies every row, so run it during a maintenance window.
+        """
+        from . import partitions
+
+        if not partitions.is_supported():
+            click.echo("Partitioning needs Postgres; SQLite keeps the single table.")
+            return
+        if partitions.is_partitioned():
+            click.echo("sensor_data is already partitioned.")
+            return
+
+        copied = partitions.migrate_to_partitioned(months_ahead)
+        click.echo(f"Copied {copied} rows into {len(partitions.list_partitions())} partitions.")
+        click.echo("Drop sensor_data_unpartitioned once the new table is verified.")
+
+    @server.cli.command('create-partitions')
+    @click.option('--months-ahead', default=3, show_default=True, help='Future months to create.')
+    def create_partitions(months_ahead):
+        """Creates sensor_data partitions for the current and coming months."""
+        from . import partitions
+
+        if not partitions.is_partitioned():
+            click.echo("sensor_data is not partitioned; run partition-sensor-data first.")
+            return
+
+        created = partitions.ensure_partitions(months_ahead)
+        click.echo(f"Created: {', '.join(created)}" if created else "All partitions already exist.")
+
+    @server.cli.command('detach-partitions')
+    @click.option('--before', required=True, help='Detach months before this one (YYYY-MM).')
+    def detach_partitions(before):
+        """
+        Detaches old monthly partitions from sensor_data. The detached tables
+        keep their rows; dump them (pg_dump -t) and drop them to archive.
+        """
+        from . import partitions
+
+        if not partitions.is_partitioned():
+            click.echo("sensor_data is not partitioned.")
+            return
+
+        detached = partitions.detach_partitions(partitions.parse_month(before))
+        click.echo(f"Detached: {', '.join(detached)}" if detached else "Nothing to detach.")
+
+    @server.cli.command('archive-deployments')
+    @click.option('--older-than-days', default=365, show_default=True,
+                  help='Archive deployments that ended more than this many days ago.')
+    def archive_deployments(older_than_days):
+        """
+        Moves raw sensor_data of closed deployments to Parquet files in
+        ARCHIVE_DIR and deletes them from the database. Archived data stays
+        readable through get_data and the deployment statistics.
+        """
+        from .archive import archive_closed_deployments
+
+        archived = archive_closed_deployments(older_than_days)
+        if not archived:
+            click.echo("Nothing to archive.")
+        for name, start, end, rows in archived:
+            click.echo(f"{name}: archived {rows} rows from {start:%Y-%m-%d} to {end:%Y-%m-%d}.")
+
+    @server.cli.command('migrate-sensor-images')
+    def migrate_sensor_images():
+        """
+        Moves images from the legacy sensors.image_data column into
+        sensor_images (thumbnail and full size) and clears the column.
+        The server also does this at startup.
+        """
+        from .models import migrate_legacy_images
+
+        results = migrate_legacy_images()
+        for name, migrated in results:
+            if migrated:
+                click.echo(f"Migrated image for {name}.")
+            else:
+                click.echo(f"Could not read the image for {name}; left in place.")
+        if not results:
+            click.echo("No images to migrate.")
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 
 db = SQLAlchemy()
 
@@ -6,5 +7,38 @@ def init_db(server):
     db.init_app(server)
     with server.app_context():
         db.create_all()
-        
-    
\ No newline at end of file
+
+        # create_all does not touch indexes of existing tables, and ingest's
+        # ON CONFLICT needs this one. Without it, fall back to plain inserts.
+        unique = has_unique_key('sensor_data', ['sensor_id', 'parameter_id', 'timestamp'])
+        server.config['SENSOR_DATA_UNIQUE_INDEX'] = unique
+        if not unique:
+            print("WARNING: sensor_data has no unique index on (sensor_id, parameter_id, timestamp), "
+                  "so duplicate uplinks are not dropped by the database. "
+                  "Run `flask dedupe-sensor-data`, then restart.")
+
+def has_unique_key(table_name, columns):
+    """True if a unique index or constraint of the table covers exactly these columns."""
+    try:
+        inspector = inspect(db.engine)
+        keys = [index['column_names'] for index in inspector.get_indexes(table_name) if index['unique']]
+        keys += [constraint['column_names'] for constraint in inspector.get_unique_constraints(table_name)]
+    except Exception as e:
+        print(f"Could not inspect the indexes of {table_name}: {e}")
+        return True
+    return any(set(key) == set(columns) for key in keys)
+
+def dialect_insert(table):
+    """
+    Returns an INSERT for the current database that supports
+    on_conflict_do_nothing/on_conflict_do_update (Postgres and SQLite).
+    Returns None for other databases.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
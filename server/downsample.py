@@ -0,0 +1,81 @@
+import numpy as np
+
+# Point reduction for time-series graphs. Both functions return the sorted
+# indices of the points to keep and always keep the first and last point
+# (the last one carries the "Live" marker).
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets over numeric x (e.g. epoch seconds) and y.
+
+    Vectorized: every bucket is scored at once, using the mean of the previous
+    bucket as the fixed vertex instead of the point picked there (which would
+    make the buckets sequential). The picked points are visually the same.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # n_out - 2 buckets over the interior points 1 .. n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+
+    mean_x = np.add.reduceat(x[:n - 1], starts) / counts
+    mean_y = np.add.reduceat(y[:n - 1], starts) / counts
+
+    # Vertices either side of each bucket: previous bucket mean (first point
+    # for bucket 0) and next bucket mean (last point for the final bucket)
+    ax = np.concatenate(([x[0]], mean_x[:-1]))
+    ay = np.concatenate(([y[0]], mean_y[:-1]))
+    cx = np.concatenate((mean_x[1:], [x[-1]]))
+    cy = np.concatenate((mean_y[1:], [y[-1]]))
+
+    bucket = np.repeat(np.arange(len(counts)), counts)
+    px, py = x[1:n - 1], y[1:n - 1]
+    area = np.abs((ax[bucket] - cx[bucket]) * (py - ay[bucket])
+                  - (ax[bucket] - px) * (cy[bucket] - ay[bucket]))
+
+    # First point with the largest area in each bucket
+    best = np.maximum.reduceat(area, starts - 1)
+    candidates = np.flatnonzero(area == best[bucket])
+    _, first = np.unique(bucket[candidates], return_index=True)
+    picked = candidates[first] + 1
+
+    return np.concatenate(([0], picked, [n - 1]))
+
+def min_max_envelope(y, n_out):
+    """
+    Keeps the lowest and highest point of each bucket, so spikes always show.
+    Returns at most n_out indices.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=float)
+    n_buckets = (n_out - 2) // 2
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    bucket = np.repeat(np.arange(n_buckets), counts)
+    interior = y[1:n - 1]
+
+    picked = []
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(interior, starts - 1)
+        candidates = np.flatnonzero(interior == extreme[bucket])
+        _, first = np.unique(bucket[candidates], return_index=True)
+        picked.append(candidates[first] + 1)
+
+    return np.unique(np.concatenate(([0], picked[0], picked[1], [n - 1])))
+
+def downsample(x, y, n_out, method='lttb'):
+    """Indices to keep with the configured method ('lttb' or 'minmax')."""
+    if method == 'minmax':
+        return min_max_envelope(y, n_out)
+    return lttb(x, y, n_out)
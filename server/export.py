@@ -0,0 +1,278 @@
+import csv
+import io
+import queue
+import tempfile
+import zipfile
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+from flask import current_app
+from werkzeug.utils import secure_filename
+from .database import db
+from .models import iter_data, get_window_parameters, get_sensor_timezone
+from .socketio import socketio
+
+# Data downloads, streamed straight from the database. Rows are read through
+# iter_data (server-side cursor, archived rows merged in) and written out in
+# chunks, so a multi-month export never holds the whole range in memory.
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+}
+
+
+def column_label(name, unit):
+    return f"{name} {f'({unit})' if unit else ''}"
+
+def iter_csv(sensor_name, start_date, end_date, lora=False, localize_input=True, chunk_rows=2000):
+    """
+    Yields the CSV export of a sensor as text chunks: one row per timestamp
+    (in the sensor's timezone), one column per parameter. Rows arrive ordered
+    by timestamp, so each line is written as soon as the next timestamp starts.
+    """
+    timezone_str = get_sensor_timezone(sensor_name)
+    target_tz = pytz.timezone(timezone_str)
+    parameters = get_window_parameters(sensor_name, start_date, end_date, lora, localize_input)
+    columns = {name: index for index, (name, _) in enumerate(parameters)}
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    buffer.write(f"Sensor Name: {sensor_name}\n")
+    writer.writerow([f"timestamp ({timezone_str})"] + [column_label(name, unit) for name, unit in parameters])
+
+    current_ts = None
+    line = None
+    lines = 0
+    missing = set()
+
+    for row in iter_data(sensor_name, start_date, end_date, lora, localize_input):
+        if row.timestamp != current_ts:
+            if line is not None:
+                writer.writerow(line)
+                lines += 1
+                if lines % chunk_rows == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    socketio.sleep(0)  # Let other greenlets run between chunks
+            current_ts = row.timestamp
+            local_ts = current_ts.replace(tzinfo=pytz.utc).astimezone(target_tz).replace(tzinfo=None)
+            line = [local_ts] + [''] * len(columns)
+
+        index = columns.get(row.name)
+        if index is None:
+            missing.add(row.name)
+            continue
+        line[index + 1] = row.value
+
+    if line is not None:
+        writer.writerow(line)
+    if missing:
+        print(f"CSV export of {sensor_name}: no column for {', '.join(sorted(missing))} (run `flask rebuild-rollups`)")
+    yield buffer.getvalue()
+
+def gzip_chunks(chunks, level=6):
+    """Gzips a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# ----------------
+# Parquet / Arrow
+#-----------------
+def data_schema(sensor_name, timezone_str, parameters):
+    """
+    Wide schema of a columnar export: a timezone-aware timestamp, then one
+    float64 column per parameter with its unit in the field metadata.
+    """
+    fields = [pa.field('timestamp', pa.timestamp('us', tz=timezone_str), nullable=False)]
+    fields += [pa.field(name, pa.float64(), metadata={'unit': unit or ''}) for name, unit in parameters]
+    return pa.schema(fields, metadata={'sensor_name': sensor_name, 'timezone': timezone_str})
+
+def _pivot_batch(timestamps, indexes, values, schema):
+    """One RecordBatch from timestamp-ordered (timestamp, column index, value) rows."""
+    ts = np.array(timestamps, dtype='datetime64[us]')
+    starts = np.empty(len(ts), dtype=bool)
+    starts[0] = True
+    np.not_equal(ts[1:], ts[:-1], out=starts[1:])
+    line = np.cumsum(starts) - 1
+    n_lines = line[-1] + 1
+
+    indexes = np.array(indexes)
+    values = np.array(values, dtype=float)
+    arrays = [pa.array(ts[starts], type=schema.field(0).type)]  # Naive UTC in, tz-aware out
+    for index in range(len(schema) - 1):
+        rows = indexes == index
+        column = np.zeros(n_lines)
+        present = np.zeros(n_lines, dtype=bool)
+        column[line[rows]] = values[rows]
+        present[line[rows]] = True
+        arrays.append(pa.array(column, mask=~present))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def iter_record_batches(sensor_name, start_date, end_date, schema, lora=False, localize_input=True, batch_rows=50000):
+    """
+    Pivots the rows of iter_data into RecordBatches of about batch_rows
+    readings. Batches always end on a timestamp boundary, so no line is split.
+    """
+    columns = {name: index for index, name in enumerate(schema.names[1:])}
+    timestamps, indexes, values = [], [], []
+
+    for row in iter_data(sensor_name, start_date, end_date, lora, localize_input):
+        index = columns.get(row.name)
+        if index is None:
+            continue
+        if len(timestamps) >= batch_rows and row.timestamp != timestamps[-1]:
+            yield _pivot_batch(timestamps, indexes, values, schema)
+            timestamps, indexes, values = [], [], []
+        timestamps.append(row.timestamp)
+        indexes.append(index)
+        values.append(row.value)
+
+    if timestamps:
+        yield _pivot_batch(timestamps, indexes, values, schema)
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file handing out the bytes written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_columnar(sensor_name, start_date, end_date, fmt='parquet', lora=False, localize_input=True):
+    """
+    Yields a Parquet (zstd) or Arrow IPC file (fmt 'arrow', zstd buffers) of
+    a sensor's data as byte chunks, one row group / record batch at a time.
+    Both load directly into pandas (read_parquet / read_feather) with types,
+    timezone and units intact.
+    """
+    timezone_str = get_sensor_timezone(sensor_name)
+    parameters = get_window_parameters(sensor_name, start_date, end_date, lora, localize_input)
+    schema = data_schema(sensor_name, timezone_str, parameters)
+
+    sink = _ChunkSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+    for batch in iter_record_batches(sensor_name, start_date, end_date, schema, lora, localize_input):
+        writer.write_batch(batch)
+        yield sink.drain()
+        socketio.sleep(0)
+
+    writer.close()
+    yield sink.drain()
+
+
+def iter_export(sensor_name, start_date, end_date, fmt='csv', lora=False, localize_input=True):
+    """One sensor's export in any of EXPORT_FORMATS, as byte chunks."""
+    if fmt == 'csv':
+        return (chunk.encode('utf-8') for chunk in iter_csv(sensor_name, start_date, end_date, lora, localize_input))
+    return iter_columnar(sensor_name, start_date, end_date, fmt, lora, localize_input)
+
+
+# ----------------
+# Bulk (ZIP)
+#-----------------
+def iter_bulk_zip(sensor_names, start_date, end_date, fmt='csv', lora=False, workers=4):
+    """
+    Yields a ZIP with one export file per sensor as byte chunks.
+
+    Up to `workers` background tasks (each with its own app context and
+    session) build the per-sensor files in parallel into temporary files.
+    Finished files are copied into the archive in completion order, and the
+    archive is written to an unseekable sink (data descriptors), so only the
+    files still being built are on disk and nothing is held in memory.
+    """
+    app = current_app._get_current_object()
+    extension = EXPORT_FORMATS[fmt][1]
+    # CSV compresses well; Parquet and Arrow are already zstd-compressed
+    compression = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+
+    pending = queue.Queue()
+    for name in sensor_names:
+        pending.put(name)
+    finished = queue.Queue()
+    cancelled = []
+
+    def build():
+        with app.app_context():
+            while not cancelled:
+                try:
+                    name = pending.get_nowait()
+                except queue.Empty:
+                    return
+                spool = tempfile.TemporaryFile()
+                try:
+                    for chunk in iter_export(name, start_date, end_date, fmt, lora):
+                        spool.write(chunk)
+                    spool.seek(0)
+                    finished.put((name, spool, None))
+                except Exception as e:
+                    db.session.rollback()
+                    spool.close()
+                    finished.put((name, None, e))
+                finally:
+                    db.session.remove()
+
+    for _ in range(max(1, min(workers, len(sensor_names)))):
+        socketio.start_background_task(build)
+
+    sink = _ChunkSink()
+    received = 0
+    try:
+        with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+            while received < len(sensor_names):
+                name, spool, error = finished.get()
+                received += 1
+                member = f"{secure_filename(name) or 'sensor'}.{extension}"
+                if error is not None:
+                    print(f"Bulk export of {name} failed: {error}")
+                    archive.writestr(f"{member}.error.txt", f"Export failed: {error}\n")
+                    continue
+
+                with spool, archive.open(member, 'w', force_zip64=True) as target:
+                    while True:
+                        chunk = spool.read(1 << 20)
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        yield sink.drain()
+        yield sink.drain()
+    finally:
+        # Client went away: stop the workers and drop what they built
+        cancelled.append(True)
+        while received < len(sensor_names):
+            try:
+                _, spool, _ = finished.get_nowait()
+            except queue.Empty:
+                break
+            received += 1
+            if spool is not None:
+                spool.close()
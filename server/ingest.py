@@ -0,0 +1,426 @@
+import collections
+import math
+import numbers
+import pytz
+import queue
+import time
+from flask import current_app
+from sqlalchemy import insert, update, exc
+from .database import db, dialect_insert
+from .cache import sensor_cache, data_cache, RecentKeys
+from .realtime import emit_sensor_update
+from .rollups import update_rollups, update_latest
+from .socketio import socketio
+from .models import (Sensor,
+                     SensorData,
+                     HEALTH_PARAMS,
+                     get_or_create_parameter,
+                     get_sensor_meta)
+from server.parser import parsers
+from .metrics import INGEST_STAGE_SECONDS, INGEST_UPLINKS, INGEST_ROWS
+
+# Keys of recently written rows, checked before the insert to drop duplicates
+recent_keys = RecentKeys(capacity=100000)
+dedup_stats = {
+    "lru_hits": 0,           # rows dropped by the in-memory check
+    "db_conflicts": 0,       # rows skipped by ON CONFLICT DO NOTHING
+    "duplicate_uplinks": 0,  # uplinks where every row was a duplicate
+}
+
+
+# Helper function to guess unit
+def guess_unit(param_name):
+    param = param_name.lower()
+    PARAMETER_UNITS = {
+        "temperature": "°C",
+        "pressure": "Pa",
+        "humidity": "%",
+        "velocity": "m/s",
+        "acceleration": "m/s²",
+        "water_level": "m",
+        "wave_height": "m",
+        "depth": "m",
+        "dissolved_oxygen": "mg/L",
+        "conductivity": "µS/cm",
+        "turbidity": "NTU",
+        "ph": "",
+        "rssi": "dBm",
+        "snr": "dB",
+        "battery": "V",
+    }
+    return PARAMETER_UNITS.get(param, "")
+
+def parse_uplink(sensor_data, fmt=None):
+    """
+    Parses a raw uplink with the registered parser for its format and looks
+    up its sensor. fmt is the format name when the caller knows it;
+    otherwise it is detected from the payload.
+
+    Returns (payload, sensor, error) where error is None on success. For
+    devices that have not been onboarded, payload is set and sensor is None.
+    Uplinks are only counted under their sensor name once it is known to be
+    onboarded, so made-up names cannot add metric series.
+    """
+    if not isinstance(sensor_data, dict):
+        return None, None, 'Payload must be a JSON object'
+
+    with INGEST_STAGE_SECONDS.time('parse'):
+        fmt, payload = parsers.parse(sensor_data, fmt)
+
+    if fmt is None:
+        INGEST_UPLINKS.inc('', 'unknown', 'rejected')
+        return None, None, 'Unknown payload format'
+
+    if not payload:
+        INGEST_UPLINKS.inc('', fmt, 'rejected')
+        return None, None, 'Parsing failed or empty data'
+
+    #Reject messages from devices that have not been onboarded
+    sensor_name = payload['sensor_name']
+    with INGEST_STAGE_SECONDS.time('sensor_lookup'):
+        sensor = get_sensor_meta(sensor_name)
+    if not sensor:
+        INGEST_UPLINKS.inc('', fmt, 'rejected')
+        return payload, None, f"Device '{sensor_name}' not onboarded."
+
+    INGEST_UPLINKS.inc(sensor.name, fmt, 'parsed')
+    return payload, sensor, None
+
+def to_utc_naive(timestamp):
+    """SensorData.timestamp is stored as naive UTC."""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+    return timestamp
+
+def measurement_value(name, value):
+    """
+    A measurement as a float. Raises ValueError unless it is a finite number
+    (or a string holding one).
+    """
+    if isinstance(value, bool) or not isinstance(value, (numbers.Real, str)):
+        raise ValueError(f"Measurement '{name}' is not a number: {value!r:.40}")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"Measurement '{name}' is not a number: {value!r:.40}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"Measurement '{name}' is not finite: {value!r:.40}")
+    return number
+
+def build_rows(payload, sensor):
+    """
+    Turns a parsed payload into SensorData insert rows for an onboarded sensor
+    (a Sensor or cached SensorMeta). Reported lat/lon are stored as
+    measurements; store_payloads writes them to the sensors row.
+    Parameter ids come from the in-process registry, so known parameters cost
+    no queries.
+
+    Returns (rows, new_data, timestamp). new_data is the list emitted over WebSocket.
+    Raises ValueError when a measurement is not a number, before any
+    parameter is created.
+    """
+    #Data prep. Handle lat and long (not reported by LoRaWAN sensors)
+    measurements = payload['measurements']
+    timestamp = to_utc_naive(measurements.get('timestamp'))
+
+    #Add lat/lon to measurements to store in SensorData and track over time
+    if has_location(payload):
+        measurements['latitude'] = measurement_value('latitude', payload['lat'])
+        measurements['longitude'] = measurement_value('longitude', payload['lon'])
+
+    values = [
+        (param_name, measurement_value(param_name, param_value))
+        for param_name, param_value in measurements.items()
+        if param_name.lower() != 'timestamp' and param_value is not None
+    ]
+
+    rows = []
+    new_data = [] #dictionary to emit
+    lookup_seconds = 0.0
+
+    for param_name, param_value in values:
+        #Find the parameter or create it if it is new
+        started = time.perf_counter()
+        parameter = get_or_create_parameter(param_name, guess_unit(param_name))
+        lookup_seconds += time.perf_counter() - started
+
+        rows.append({
+            'sensor_id': sensor.id,
+            'parameter_id': parameter.id,
+            'timestamp': timestamp,
+            'value': param_value
+        })
+
+        new_data.append({
+            'name': param_name,
+            'value': param_value,
+            'is_health': param_name in HEALTH_PARAMS
+        })
+
+    INGEST_STAGE_SECONDS.observe(lookup_seconds, 'parameter_lookup')
+    return rows, new_data, timestamp
+
+def has_location(payload):
+    return payload.get('lat') is not None and payload.get('lon') is not None
+
+def row_key(row):
+    return (row['sensor_id'], row['parameter_id'], row['timestamp'])
+
+def insert_rows(rows):
+    """
+    Writes SensorData rows with a single executemany. SQLAlchemy batches these
+    into multi-row INSERT statements on Postgres.
+
+    Rows that already exist (same sensor, parameter and timestamp) are skipped
+    with ON CONFLICT DO NOTHING. Returns the rows actually inserted as
+    (sensor_id, parameter_id, timestamp, value) tuples.
+
+    Databases still missing the unique index (init_db checks at startup) get
+    a plain insert, as ON CONFLICT would fail.
+    """
+    if not rows:
+        return []
+
+    table = SensorData.__table__
+    stmt = dialect_insert(table)
+    if stmt is None or not current_app.config.get('SENSOR_DATA_UNIQUE_INDEX', True):
+        db.session.execute(insert(table), rows)
+        return [(r['sensor_id'], r['parameter_id'], r['timestamp'], r['value']) for r in rows]
+
+    stmt = stmt.on_conflict_do_nothing(index_elements=['sensor_id', 'parameter_id', 'timestamp']) \
+        .returning(table.c.sensor_id, table.c.parameter_id, table.c.timestamp, table.c.value)
+    inserted = db.session.execute(stmt, rows).all()
+
+    dedup_stats["db_conflicts"] += len(rows) - len(inserted)
+    return inserted
+
+
+def store_payloads(items):
+    """
+    Writes a group of parsed payloads with one bulk insert and one commit,
+    then emits one sensor_update per sensor for its newest uplink. The
+    hourly/daily rollups and sensor_latest are updated in the same transaction.
+
+    Args:
+        items (list): (payload, sensor) pairs; sensor is a Sensor or SensorMeta.
+
+    Retransmits and multi-gateway copies are dropped before the insert when
+    their (sensor, parameter, timestamp) keys were written recently, and by
+    the unique index otherwise.
+
+    Returns a list with, per item, the number of new rows or an error
+    string. Database errors are raised after rolling back.
+    """
+    results = []
+    all_rows = []
+    batch_keys = set()
+    latest = {}     # sensor name -> newest (timestamp, measurements) to emit
+    locations = {}  # sensor id -> (lat, lon) reported by the newest uplink
+
+    for payload, sensor in items:
+        try:
+            rows, new_data, timestamp = build_rows(payload, sensor)
+        except Exception as e:
+            results.append(str(e))
+            continue
+
+        if not rows or timestamp is None:
+            results.append('No measurements')
+            continue
+
+        fresh = []
+        for row in rows:
+            key = row_key(row)
+            if key in batch_keys or key in recent_keys:
+                dedup_stats["lru_hits"] += 1
+                continue
+            batch_keys.add(key)
+            fresh.append(row)
+
+        results.append(len(fresh))
+        if not fresh:
+            dedup_stats["duplicate_uplinks"] += 1
+            continue
+        all_rows.extend(fresh)
+
+        if sensor.name not in latest or timestamp >= latest[sensor.name][0]:
+            latest[sensor.name] = (timestamp, new_data)
+            #Update Sensor table (map pin updates from this)
+            if has_location(payload):
+                locations[sensor.id] = (float(payload['lat']), float(payload['lon']))
+
+    try:
+        with INGEST_STAGE_SECONDS.time('insert'):
+            inserted = insert_rows(all_rows)
+            for sensor_id, (lat, lon) in locations.items():
+                db.session.execute(
+                    update(Sensor)
+                    .where(Sensor.id == sensor_id)
+                    .values(latitude=lat, longitude=lon)
+                )
+        with INGEST_STAGE_SECONDS.time('rollup'):
+            update_rollups(inserted)
+            update_latest(inserted)
+        with INGEST_STAGE_SECONDS.time('commit'):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    sensor_names = {sensor.id: sensor.name for _, sensor in items}
+    for sensor_id, count in collections.Counter(row[0] for row in inserted).items():
+        INGEST_ROWS.inc(sensor_names[sensor_id], amount=count)
+
+    # Only remember keys once they are committed, so a failed write can be retried
+    recent_keys.add_many(batch_keys)
+
+    if locations:
+        sensor_cache.invalidate()
+    data_cache.invalidate(inserted)
+
+    #Real time data
+    with INGEST_STAGE_SECONDS.time('emit'):
+        for sensor_name, (timestamp, new_data) in latest.items():
+            emit_sensor_update(sensor_name, timestamp, new_data)
+
+    return results
+
+def is_transient_error(error):
+    """Connectivity and operational database errors, worth retrying unchanged."""
+    if isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError)):
+        return True
+    return getattr(error, 'connection_invalidated', False)
+
+def store_payloads_isolated(items):
+    """
+    store_payloads for background writers. When the group fails with a data
+    error (a row the database rejects), the items are stored one at a time so
+    only the bad ones fail.
+
+    Returns, per item, the store_payloads result or the exception the item
+    failed with. Transient errors (see is_transient_error) are raised, the
+    caller retries the whole group.
+    """
+    try:
+        return store_payloads(items)
+    except Exception as e:
+        if is_transient_error(e):
+            raise
+        if len(items) == 1:
+            return [e]
+        print(f"Ingest group of {len(items)} failed ({e}), storing one uplink at a time")
+
+    results = []
+    for item in items:
+        try:
+            results.append(store_payloads([item])[0])
+        except Exception as e:
+            if is_transient_error(e):
+                raise
+            results.append(e)
+    return results
+
+
+class IngestQueue:
+    """
+    Asynchronous ingest: routes enqueue parsed payloads and a background
+    writer greenlet drains the queue, committing in groups of up to
+    max_group uplinks or whatever arrived within max_wait_ms.
+
+    Uplinks are acknowledged before they are written, so a group is never
+    dropped: transient database errors retry it with backoff (the queue
+    fills up and routes answer 503 meanwhile), and data errors fall back to
+    storing its uplinks one at a time.
+    """
+
+    def __init__(self, max_group=500, max_wait_ms=200, maxsize=10000):
+        self.max_group = max_group
+        self.max_wait_ms = max_wait_ms
+        self.queue = queue.Queue(maxsize)
+        self.running = False
+        self.stats = {
+            "groups_committed": 0,
+            "groups_failed": 0,      # attempts that hit a transient error and were retried
+            "uplinks_written": 0,
+            "uplinks_failed": 0,
+            "rows_written": 0,
+            "last_group_size": 0,
+            "max_group_size": 0,
+            "last_commit_ms": 0.0,
+            "max_commit_ms": 0.0,
+            "total_commit_ms": 0.0,
+            "last_error": None,
+        }
+
+    def start(self, app):
+        if not self.running:
+            self.running = True
+            socketio.start_background_task(self._run, app)
+
+    def put(self, payload, sensor):
+        """Enqueues without blocking. Raises queue.Full when the writer has fallen behind."""
+        self.queue.put_nowait((payload, sensor))
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        groups = stats["groups_committed"]
+        stats["queue_depth"] = self.queue.qsize()
+        stats["avg_group_size"] = round(stats["uplinks_written"] / groups, 1) if groups else 0
+        stats["avg_commit_ms"] = round(stats["total_commit_ms"] / groups, 2) if groups else 0
+        return stats
+
+    def _collect(self):
+        group = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(group) < self.max_group:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self, app):
+        with app.app_context():
+            while self.running:
+                group = self._collect()
+                results, started = self._store(group)
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                stats = self.stats
+                stats["groups_committed"] += 1
+                stats["last_group_size"] = len(group)
+                stats["max_group_size"] = max(stats["max_group_size"], len(group))
+                stats["last_commit_ms"] = round(elapsed_ms, 2)
+                stats["max_commit_ms"] = max(stats["max_commit_ms"], stats["last_commit_ms"])
+                stats["total_commit_ms"] += elapsed_ms
+                for (payload, _), result in zip(group, results):
+                    if isinstance(result, int):
+                        stats["uplinks_written"] += 1
+                        stats["rows_written"] += result
+                    else:
+                        stats["uplinks_failed"] += 1
+                        stats["last_error"] = str(result)
+                        if isinstance(result, Exception):
+                            print(f"Ingest queue: uplink from {payload['sensor_name']} not stored: {result}")
+
+    def _store(self, group):
+        """Stores a group, retrying transient errors with backoff until it goes through."""
+        backoff = 0.5
+        while True:
+            started = time.perf_counter()
+            try:
+                return store_payloads_isolated(group), started
+            except Exception as e:
+                self.stats["groups_failed"] += 1
+                self.stats["last_error"] = str(e)
+                print(f"Ingest queue commit error (retrying in {backoff}s): {e}")
+            finally:
+                db.session.remove()
+            socketio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+ingest_queue = IngestQueue()
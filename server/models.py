@@ -1,12 +1,21 @@
 from server import db
-from sqlalchemy import Index, func
+from server.database import dialect_insert
+from sqlalchemy import Index, func, tuple_
+import heapq
+from collections import namedtuple
+import pandas as pd
 from datetime import datetime, timedelta
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
-from server.utils import compress_image
+from server.utils import make_image_sizes
+import hashlib
+from server.cache import parameter_registry, sensor_cache, request_memo, data_cache
 
 HEALTH_PARAMS = ['Battery', 'RSSI', 'SNR', 'battery', 'rssi', 'snr']
 
+# Rows of get_data_page read from the Parquet archive
+ArchivedPageRow = namedtuple('ArchivedPageRow', ['timestamp', 'parameter_id', 'value', 'name', 'unit'])
+
 user_sensor_association = db.Table('user_sensor',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
     db.Column('sensor_id', db.Integer, db.ForeignKey('sensors.id'), primary_key=True)
@@ -62,7 +71,7 @@ class Sensor(db.Model):
     device_type = db.Column(db.String(50))  # 'sonde', 'tide_gauge', etc.
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
-    image_data = db.Column(db.Text, nullable=True)
+    image_data = db.Column(db.Text, nullable=True)  # Legacy, moved to SensorImage at startup (migrate_legacy_images)
     timezone = db.Column(db.String(50), default='America/Chicago', nullable=False)
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -76,22 +85,19 @@ class Sensor(db.Model):
         Dynamically calculates if the sensor is online based on
         whether it has transmitted data in the last 2 hours.
         """
-        # If the sensor is manually deactivated, it's considered offline
-        if not self.active:
-            return False
-
-        # Get the most recent data point for this sensor
-        latest_ping = SensorData.query.filter_by(sensor_id=self.id) \
-            .order_by(SensorData.timestamp.desc()) \
-            .first()
+        return is_sensor_online(self)
 
-        # If it has never sent data, it's offline
-        if not latest_ping:
-            return False
+# Sensor photos, pre-resized, served by /sensor-image/<name>. Kept out of the
+# sensors row so fleet queries never load image bytes.
+class SensorImage(db.Model):
+    __tablename__ = 'sensor_images'
 
-        # Check if the latest ping was within the last 2 hours
-        two_hours_ago = datetime.utcnow() - timedelta(hours=2)
-        return latest_ping.timestamp >= two_hours_ago
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensors.id', ondelete='CASCADE'), primary_key=True)
+    thumb = db.Column(db.LargeBinary, nullable=False)
+    full = db.Column(db.LargeBinary, nullable=False)
+    content_type = db.Column(db.String(50), default='image/jpeg', nullable=False)
+    etag = db.Column(db.String(40), nullable=False)  # sha1 of full, also the URL version
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Parameter table
 class Parameter(db.Model):
@@ -117,38 +123,243 @@ class SensorData(db.Model):
     sensor = db.relationship("Sensor", back_populates="data")
     parameter = db.relationship("Parameter", back_populates="data")
 
-    # composite index for speed.
+    # composite index for speed. Unique so retransmitted uplinks are stored once
+    # (existing databases: run `flask dedupe-sensor-data`; init_db warns until then).
+    __table_args__ = (
+        Index('idx_sensor_param_time', 'sensor_id', 'parameter_id', 'timestamp', unique=True),
+    )
+
+# Rollup tables: count/sum/min/max of SensorData per sensor, parameter and UTC
+# hour or day. Kept current at ingest (server/rollups.py) and rebuilt with
+# `flask rebuild-rollups`.
+class SensorDataHourly(db.Model):
+    __tablename__ = 'sensor_data_hourly'
+
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensors.id', ondelete='CASCADE'), primary_key=True)
+    parameter_id = db.Column(db.Integer, db.ForeignKey('parameters.id'), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+
+class SensorDataDaily(db.Model):
+    __tablename__ = 'sensor_data_daily'
+
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensors.id', ondelete='CASCADE'), primary_key=True)
+    parameter_id = db.Column(db.Integer, db.ForeignKey('parameters.id'), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+
+# Newest reading per sensor and parameter, upserted at ingest. Current values,
+# last-seen and online status read this instead of scanning sensor_data.
+class SensorLatest(db.Model):
+    __tablename__ = 'sensor_latest'
+
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensors.id', ondelete='CASCADE'), primary_key=True)
+    parameter_id = db.Column(db.Integer, db.ForeignKey('parameters.id'), primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    value = db.Column(db.Float, nullable=False)
+
+# Raw SensorData moved out of the database into Parquet files by
+# server/archive.py. One row per archived (sensor, time range, monthly file).
+class ArchivedRange(db.Model):
+    __tablename__ = 'archived_ranges'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensors.id', ondelete='CASCADE'), nullable=False)
+    start = db.Column(db.DateTime, nullable=False)  # inclusive
+    end = db.Column(db.DateTime, nullable=False)    # exclusive
+    path = db.Column(db.String(255), nullable=False)  # relative to ARCHIVE_DIR
+    row_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
     __table_args__ = (
-        Index('idx_sensor_param_time', 'sensor_id', 'parameter_id', 'timestamp'),
+        Index('idx_archived_sensor_range', 'sensor_id', 'start', 'end'),
     )
 
+# Per-parameter statistics of a closed deployment, computed once by
+# get_deployment_stats. The window of a closed deployment no longer changes.
+class DeploymentStats(db.Model):
+    __tablename__ = 'deployment_stats'
+
+    deployment_id = db.Column(db.Integer, db.ForeignKey('location_history.id', ondelete='CASCADE'), primary_key=True)
+    parameter_id = db.Column(db.Integer, db.ForeignKey('parameters.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    mean = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    stddev = db.Column(db.Float, nullable=False)
+    # Percentiles (see PERCENTILES), NULL where they could not be computed
+    p05 = db.Column(db.Float)
+    median = db.Column(db.Float)
+    p95 = db.Column(db.Float)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+ROLLUP_MODELS = {
+    'hourly': SensorDataHourly,
+    'daily': SensorDataDaily,
+}
+
+# Deployment statistics percentiles, stored as p05, median and p95
+PERCENTILES = (0.05, 0.5, 0.95)
+
+def bucket_start(timestamp, resolution):
+    """Start of the hourly/daily bucket holding a naive UTC timestamp."""
+    if resolution == 'daily':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def bucket_end(timestamp, resolution):
+    """First bucket boundary at or after timestamp."""
+    start = bucket_start(timestamp, resolution)
+    if start == timestamp:
+        return start
+    return start + (timedelta(days=1) if resolution == 'daily' else timedelta(hours=1))
+
+def choose_resolution(start_date, end_date):
+    """Raw rows up to a week, hourly rollups up to ~2 months, daily beyond."""
+    span = (end_date or datetime.utcnow()) - start_date
+    if span <= timedelta(days=7):
+        return 'raw'
+    if span <= timedelta(days=62):
+        return 'hourly'
+    return 'daily'
+
 # ----------------
 # Query functions
 #-----------------
+# Read helpers marked @request_memo query once per request for the same
+# arguments (see server/cache.py).
 def get_sensor_by_name(name):
     return db.session.query(Sensor).filter(Sensor.name == name).first()
 
 def get_param_by_name(name):
     return db.session.query(Parameter).filter(Parameter.name == name).first()
 
+def get_or_create_parameter(name, canonical_unit=''):
+    """
+    Registry-backed parameter lookup for the ingest hot path.
+    Returns a ParamInfo (id, name, canonical_unit).
+    """
+    return parameter_registry.get_or_create(name, canonical_unit)
+
+def get_sensor_meta(name):
+    """
+    Cached sensor metadata (id, name, device_type, latitude, longitude,
+    timezone, active) without loading the image column. Use this for reads;
+    use get_sensor_by_name when the ORM object is needed for updates.
+    """
+    return sensor_cache.get(name)
+
+def get_sensor_image(name, size='full'):
+    """Returns (image bytes, content_type, etag) for one size, or None."""
+    column = SensorImage.thumb if size == 'thumb' else SensorImage.full
+    return (
+        db.session.query(column, SensorImage.content_type, SensorImage.etag)
+        .join(Sensor, Sensor.id == SensorImage.sensor_id)
+        .filter(Sensor.name == name)
+        .first()
+    )
+
+@request_memo
+def get_sensor_image_version(name):
+    """ETag of the sensor's image (without loading it), or None if it has none."""
+    return (
+        db.session.query(SensorImage.etag)
+        .join(Sensor, Sensor.id == SensorImage.sensor_id)
+        .filter(Sensor.name == name)
+        .scalar()
+    )
+
+def save_sensor_image(sensor_id, base64_string):
+    """Stores every size of an uploaded image for a sensor. The caller commits."""
+    sizes = make_image_sizes(base64_string)
+    if not sizes:
+        return False
+
+    image = db.session.get(SensorImage, sensor_id) or SensorImage(sensor_id=sensor_id)
+    image.thumb = sizes['thumb']
+    image.full = sizes['full']
+    image.content_type = 'image/jpeg'
+    image.etag = hashlib.sha1(sizes['full']).hexdigest()
+    db.session.add(image)
+    return True
+
+def migrate_legacy_images():
+    """
+    Moves images still in the legacy sensors.image_data column into
+    sensor_images and clears the column, one sensor per commit. Images that
+    cannot be read are left in place. Returns [(sensor name, migrated)].
+    """
+    results = []
+    sensor_ids = [sensor_id for (sensor_id,) in
+                  db.session.query(Sensor.id).filter(Sensor.image_data.isnot(None)).all()]
+    for sensor_id in sensor_ids:
+        sensor = db.session.get(Sensor, sensor_id)
+        try:
+            migrated = save_sensor_image(sensor.id, sensor.image_data)
+            if migrated:
+                sensor.image_data = None
+            db.session.commit()
+        except Exception as e:
+            # e.g. another worker migrating the same image at startup
+            db.session.rollback()
+            print(f"Could not migrate the image of sensor {sensor_id}: {e}")
+            continue
+        results.append((sensor.name, migrated))
+    return results
+
+@request_memo
+def is_sensor_online(sensor):
+    """
+    A sensor is online if it is active and has transmitted data in the
+    last 2 hours. Accepts a Sensor or a cached SensorMeta.
+    """
+    # If the sensor is manually deactivated, it's considered offline
+    if not sensor.active:
+        return False
+
+    # Get the most recent data point for this sensor
+    latest_ts = db.session.query(func.max(SensorLatest.timestamp)) \
+        .filter(SensorLatest.sensor_id == sensor.id).scalar()
+
+    # If it has never sent data, it's offline
+    if not latest_ts:
+        return False
+
+    # Check if the latest ping was within the last 2 hours
+    two_hours_ago = datetime.utcnow() - timedelta(hours=2)
+    return latest_ts >= two_hours_ago
+
 def get_sensor_timezone(sensor_name):
-    sensor = get_sensor_by_name(sensor_name)
+    sensor = get_sensor_meta(sensor_name)
     if sensor and sensor.timezone:
         return sensor.timezone
     return 'UTC'
 
 
+@request_memo
 def get_all_sensors():
     """Returns a list of all sensors as dictionaries.
        Doesn't use is_online for efficiency.
     """
-    sensors = db.session.query(Sensor).all()
+    # Metadata columns only, plus the image version for popup thumbnails
+    sensors = (
+        db.session.query(Sensor.id, Sensor.name, Sensor.latitude, Sensor.longitude,
+                         Sensor.device_type, Sensor.active, SensorImage.etag)
+        .outerjoin(SensorImage, SensorImage.sensor_id == Sensor.id)
+        .all()
+    )
 
-    #Get the latest timestamp for ALL sensors in ONE query
+    #Get the latest timestamp for ALL sensors in ONE query (one row per sensor/parameter)
     latest_data = db.session.query(
-        SensorData.sensor_id,
-        func.max(SensorData.timestamp).label('latest_ts')
-    ).group_by(SensorData.sensor_id).all()
+        SensorLatest.sensor_id,
+        func.max(SensorLatest.timestamp).label('latest_ts')
+    ).group_by(SensorLatest.sensor_id).all()
 
     latest_pings = {row.sensor_id: row.latest_ts for row in latest_data}
 
@@ -167,7 +378,7 @@ def get_all_sensors():
             "latitude": s.latitude,
             "longitude": s.longitude,
             "device_type": s.device_type,
-            "image_data": s.image_data,
+            "image_version": s.etag,
             "active": s.active,
             "is_online": is_online
         })
@@ -184,7 +395,68 @@ def get_sensors_grouped_by_type():
         grouped[d_type].append(s['name'])
     return grouped
 
-def get_data(sensor_name, start_date, end_date, lora=False, localize_input=False):
+def _data_query(sensor, start_date, end_date, lora, localize_input, resolution, end_inclusive=True):
+    """
+    Shared by get_data and iter_data. Returns (query, start_date, end_date,
+    resolution, health_ids) with the dates as naive UTC and resolution
+    resolved. end_inclusive=False reads [start_date, end_date).
+    """
+    if localize_input and sensor.timezone:
+        try:
+            local_tz = pytz.timezone(sensor.timezone)
+            if start_date.tzinfo is None:
+                start_date = local_tz.localize(start_date).astimezone(pytz.utc).replace(tzinfo=None)
+            if end_date.tzinfo is None:
+                end_date = local_tz.localize(end_date).astimezone(pytz.utc).replace(tzinfo=None)
+        except:
+            pass
+
+    # Always bounded, so Postgres only scans the partitions in range
+    end_date = end_date or datetime.utcnow()
+
+    if resolution == 'auto':
+        resolution = choose_resolution(start_date, end_date)
+
+    if resolution in ROLLUP_MODELS:
+        rollup = ROLLUP_MODELS[resolution]
+        query = (
+            db.session.query(
+                rollup.bucket.label('timestamp'),
+                (rollup.sum / rollup.count).label('value'),
+                Parameter.name.label('name'),
+                Parameter.canonical_unit.label('unit')
+            )
+            .join(Parameter, rollup.parameter_id == Parameter.id)
+            .filter(rollup.sensor_id == sensor.id)
+            .filter(rollup.bucket >= bucket_start(start_date, resolution))
+            .filter(rollup.bucket <= end_date if end_inclusive else rollup.bucket < end_date)
+        )
+        order_column, parameter_column = rollup.bucket, rollup.parameter_id
+    else:
+        query = (
+            db.session.query(
+                SensorData.timestamp.label('timestamp'),
+                SensorData.value.label('value'),
+                Parameter.name.label('name'),
+                Parameter.canonical_unit.label('unit')
+            )
+            .join(Parameter, SensorData.parameter_id == Parameter.id)
+            .filter(SensorData.sensor_id == sensor.id)
+            .filter(SensorData.timestamp >= start_date)
+            .filter(SensorData.timestamp <= end_date if end_inclusive else SensorData.timestamp < end_date)
+        )
+        order_column, parameter_column = SensorData.timestamp, SensorData.parameter_id
+
+    # Filter on parameter ids so the (sensor, parameter, time) index is used
+    health_ids = parameter_registry.ids_for(HEALTH_PARAMS)
+    if lora:
+        query = query.filter(parameter_column.in_(health_ids))
+    else:
+        query = query.filter(parameter_column.notin_(health_ids))
+
+    return query.order_by(order_column), start_date, end_date, resolution, health_ids
+
+def get_data(sensor_name, start_date, end_date, lora=False, localize_input=False, resolution='raw'):
     """
         Retrieves sensor data.
 
@@ -193,57 +465,356 @@ def get_data(sensor_name, start_date, end_date, lora=False, localize_input=False
                          False, all other data is retrieved
             localize_input (bool): If True, assumes start_date/end_date are in the
                                    SENSOR'S timezone. Converts them to UTC before querying.
+            resolution (str): 'raw', 'hourly', 'daily', or 'auto' to pick one from
+                              the span. Rollup rows carry the bucket start as
+                              timestamp and the bucket mean as value.
+
+        Rows are served from data_cache (server/cache.py) in aligned time
+        buckets; ingest drops the buckets it writes into.
         """
-    sensor = get_sensor_by_name(sensor_name)
+    sensor = get_sensor_meta(sensor_name)
     if not sensor:
         return []
 
-    if localize_input and sensor.timezone:
-        try:
-            local_tz = pytz.timezone(sensor.timezone)
-            if start_date.tzinfo is None:
-                start_date = local_tz.localize(start_date).astimezone(pytz.utc).replace(tzinfo=None)
-            if end_date.tzinfo is None:
-                end_date = local_tz.localize(end_date).astimezone(pytz.utc).replace(tzinfo=None)
-        except:
-            pass
+    # Only resolves the window; the query runs per missing cache bucket
+    _, start_date, end_date, resolution, health_ids = _data_query(
+        sensor, start_date, end_date, lora, localize_input, resolution)
+    if resolution in ROLLUP_MODELS:
+        start_date = bucket_start(start_date, resolution)
+
+    def fetch(start, end):
+        query, _, _, _, _ = _data_query(sensor, start, end, lora, False, resolution, end_inclusive=False)
+        results = query.all()
+
+        # Raw rows of archived deployments live in Parquet files (server/archive.py)
+        if resolution not in ROLLUP_MODELS:
+            from server.archive import get_archived_rows
+            archived = get_archived_rows(sensor.id, start, end,
+                                         include_ids=health_ids if lora else None,
+                                         exclude_ids=None if lora else health_ids,
+                                         end_inclusive=False)
+            if archived:
+                results = list(heapq.merge(archived, results, key=lambda row: row.timestamp))
+        return results
+
+    return data_cache.get_rows(sensor.id, bool(lora), resolution, start_date, end_date, fetch)
+
+def iter_data(sensor_name, start_date, end_date, lora=False, localize_input=False, batch_size=5000):
+    """
+    The raw rows of get_data as a generator, for exports of any size. The
+    query is read in batches of batch_size through a server-side cursor
+    (yield_per) and archived rows are merged in by timestamp, so memory use
+    does not grow with the range.
+    """
+    sensor = get_sensor_meta(sensor_name)
+    if not sensor:
+        return
 
-    query = (
-        db.session.query(
-            SensorData.timestamp.label('timestamp'),
-            SensorData.value.label('value'),
-            Parameter.name.label('name'),
-            Parameter.canonical_unit.label('unit')
-        )
-        .join(Parameter, SensorData.parameter_id == Parameter.id)
+    query, start_date, end_date, _, health_ids = _data_query(
+        sensor, start_date, end_date, lora, localize_input, 'raw')
+
+    from server.archive import iter_archived_rows
+    archived = iter_archived_rows(sensor.id, start_date, end_date,
+                                  include_ids=health_ids if lora else None,
+                                  exclude_ids=None if lora else health_ids)
+    yield from heapq.merge(archived, query.yield_per(batch_size), key=lambda row: row.timestamp)
+
+def get_window_parameters(sensor_name, start_date, end_date, lora=False, localize_input=False):
+    """
+    (name, canonical_unit) of the parameters a sensor has rows for in the
+    window, ordered by parameter id. One index probe per parameter on
+    sensor_data, and on the hourly rollup for rows that were archived.
+    Lets exports write their header before streaming the rows.
+    """
+    sensor = get_sensor_meta(sensor_name)
+    if not sensor:
+        return []
+
+    _, start_date, end_date, _, health_ids = _data_query(
+        sensor, start_date, end_date, lora, localize_input, 'raw')
+
+    raw = (
+        db.session.query(SensorData.id)
         .filter(SensorData.sensor_id == sensor.id)
+        .filter(SensorData.parameter_id == Parameter.id)
         .filter(SensorData.timestamp >= start_date)
         .filter(SensorData.timestamp <= end_date)
+        .exists()
     )
-
+    archived = (
+        db.session.query(SensorDataHourly.bucket)
+        .filter(SensorDataHourly.sensor_id == sensor.id)
+        .filter(SensorDataHourly.parameter_id == Parameter.id)
+        .filter(SensorDataHourly.bucket >= bucket_start(start_date, 'hourly'))
+        .filter(SensorDataHourly.bucket <= end_date)
+        .exists()
+    )
+    query = db.session.query(Parameter.name, Parameter.canonical_unit).filter(raw | archived)
     if lora:
-        query = query.filter(Parameter.name.in_(HEALTH_PARAMS))
+        query = query.filter(Parameter.id.in_(health_ids))
     else:
-        query = query.filter(Parameter.name.notin_(HEALTH_PARAMS))
+        query = query.filter(Parameter.id.notin_(health_ids))
+    return query.order_by(Parameter.id).all()
 
-    results = query.order_by(SensorData.timestamp).all()
+def get_data_page(sensor_name, start_date, end_date, parameters=None, resolution='raw', after=None, limit=1000):
+    """
+    One page of a sensor's data for the read API, ordered by (timestamp,
+    parameter_id) and paged by keyset: `after` is the (timestamp,
+    parameter_id) of the last row of the previous page. That pair is unique
+    per sensor (idx_sensor_param_time) and also identifies rollup buckets
+    and archived rows, which have no id.
+
+    Dates are naive UTC. parameters is a list of names (default: all but the
+    health parameters). Rollup resolutions only return closed buckets, so a
+    cursor never moves past a bucket that is still filling.
+
+    Returns (rows, resolution, has_more) with rows of (timestamp,
+    parameter_id, value, name, unit); value is the bucket mean for rollups.
+    """
+    sensor = get_sensor_meta(sensor_name)
+    if not sensor:
+        return [], resolution, False
 
-    return results
+    end_date = end_date or datetime.utcnow()
+    if resolution == 'auto':
+        resolution = choose_resolution(start_date, end_date)
+
+    include_ids = exclude_ids = None
+    if parameters:
+        include_ids = parameter_registry.ids_for(parameters)
+        if not include_ids:
+            return [], resolution, False
+    else:
+        exclude_ids = parameter_registry.ids_for(HEALTH_PARAMS)
+
+    if resolution in ROLLUP_MODELS:
+        model = ROLLUP_MODELS[resolution]
+        time_column, value_column = model.bucket, (model.sum / model.count)
+        end_date = min(end_date, bucket_start(datetime.utcnow(), resolution) - timedelta(microseconds=1))
+        start_date = bucket_start(start_date, resolution)
+    else:
+        model = SensorData
+        time_column, value_column = SensorData.timestamp, SensorData.value
 
+    query = (
+        db.session.query(time_column.label('timestamp'), model.parameter_id.label('parameter_id'),
+                         value_column.label('value'), Parameter.name.label('name'),
+                         Parameter.canonical_unit.label('unit'))
+        .join(Parameter, model.parameter_id == Parameter.id)
+        .filter(model.sensor_id == sensor.id)
+        .filter(model.parameter_id.in_(include_ids) if include_ids else model.parameter_id.notin_(exclude_ids))
+        .filter(time_column >= start_date)
+        .filter(time_column <= end_date)
+    )
+    if after is not None:
+        query = query.filter(tuple_(time_column, model.parameter_id) > tuple_(*after))
+    rows = query.order_by(time_column, model.parameter_id).limit(limit + 1).all()
+
+    # Raw rows of archived deployments, limited to the span this page can reach
+    if model is SensorData:
+        from server.archive import read_archived
+        archive_start = after[0] if after is not None else start_date
+        archive_end = rows[limit - 1].timestamp if len(rows) > limit else end_date
+        table = read_archived(sensor.id, archive_start, archive_end, include_ids, exclude_ids)
+        if table is not None and table.num_rows:
+            columns = table.to_pydict()
+            params = {
+                row.id: (row.name, row.canonical_unit)
+                for row in db.session.query(Parameter.id, Parameter.name, Parameter.canonical_unit)
+                .filter(Parameter.id.in_(set(columns['parameter_id']))).all()
+            }
+            archived = [
+                ArchivedPageRow(timestamp, parameter_id, value, *params.get(parameter_id, (str(parameter_id), '')))
+                for timestamp, parameter_id, value
+                in zip(columns['timestamp'], columns['parameter_id'], columns['value'])
+                if after is None or (timestamp, parameter_id) > tuple(after)
+            ]
+            archived.sort(key=lambda row: (row.timestamp, row.parameter_id))
+            rows = list(heapq.merge(archived[:limit + 1], rows,
+                                    key=lambda row: (row.timestamp, row.parameter_id)))
+
+    return rows[:limit], resolution, len(rows) > limit
+
+DATA_FRAME_COLUMNS = ['timestamp', 'value', 'name', 'unit']
+
+def get_data_frame(sensor_name, start_date, end_date, lora=False, localize_input=False, resolution='raw'):
+    """
+    Same rows as get_data as a pandas DataFrame (timestamp, value, name, unit),
+    ordered by timestamp, for callers that work column-wise. timestamp is
+    datetime64 in naive UTC.
+    """
+    frame = pd.DataFrame.from_records(
+        get_data(sensor_name, start_date, end_date, lora, localize_input, resolution),
+        columns=DATA_FRAME_COLUMNS)
+    frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+    return frame
+
+def _window_stats(sensor_id, start_date, end_date, exclude_ids):
+    """
+    One grouped aggregate over a sensor's raw rows in [start_date, end_date].
+    Returns {parameter_id: [count, mean, m2, min, max, percentiles]} where m2
+    is the sum of squared deviations (so windows can be merged) and
+    percentiles a list matching PERCENTILES, or None where unsupported.
+    """
+    window = [
+        SensorData.sensor_id == sensor_id,
+        SensorData.timestamp >= start_date,
+        SensorData.timestamp <= end_date,
+        SensorData.parameter_id.notin_(exclude_ids),
+    ]
+    value = SensorData.value
+
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy import cast, type_coerce
+        from sqlalchemy.dialects.postgresql import array, ARRAY
+        percentiles = func.percentile_cont(cast(array(PERCENTILES), ARRAY(db.Float))).within_group(value)
+        rows = (
+            db.session.query(SensorData.parameter_id, func.count(value), func.avg(value),
+                             func.var_samp(value), func.min(value), func.max(value),
+                             type_coerce(percentiles, ARRAY(db.Float)))
+            .filter(*window)
+            .group_by(SensorData.parameter_id)
+            .all()
+        )
+        return {
+            parameter_id: [count, mean, (variance or 0.0) * (count - 1), low, high, list(percentiles)]
+            for parameter_id, count, mean, variance, low, high, percentiles in rows
+        }
+
+    # No variance aggregate elsewhere: deviations from the per-parameter mean
+    # in a subquery (numerically stable, unlike a sum of squares)
+    means = (
+        db.session.query(SensorData.parameter_id, func.avg(value).label('mean'))
+        .filter(*window)
+        .group_by(SensorData.parameter_id)
+        .subquery()
+    )
+    deviation = value - means.c.mean
+    rows = (
+        db.session.query(SensorData.parameter_id, func.count(value), func.avg(value),
+                         func.sum(deviation * deviation), func.min(value), func.max(value))
+        .join(means, means.c.parameter_id == SensorData.parameter_id)
+        .filter(*window)
+        .group_by(SensorData.parameter_id)
+        .all()
+    )
+    return {
+        parameter_id: [count, mean, m2 or 0.0, low, high, None]
+        for parameter_id, count, mean, m2, low, high in rows
+    }
+
+def _merge_stats(a, b):
+    """Combines two [count, mean, m2, min, max, percentiles] (Chan et al.)."""
+    count = a[0] + b[0]
+    delta = b[1] - a[1]
+    return [
+        count,
+        a[1] + delta * b[0] / count,
+        a[2] + b[2] + delta * delta * a[0] * b[0] / count,
+        min(a[3], b[3]),
+        max(a[4], b[4]),
+        None,  # Percentiles of the union are unknown
+    ]
+
+def get_deployment_stats(sensor_name, start_date, end_date, deployment_id=None):
+    """
+    Count, mean, min, max, sample standard deviation and the PERCENTILES of
+    each parameter over a deployment window (naive UTC), aggregated in the
+    database and, for archived rows, in Arrow. No raw rows are transferred.
+    Percentiles need Postgres or archived rows and are None otherwise.
 
+    With deployment_id the window comes from LocationHistory, and once the
+    deployment is closed the result is stored in deployment_stats and read
+    from there afterwards. Health parameters are excluded.
+
+    Returns {parameter name: {"unit", "count", "mean", "min", "max", "stddev",
+    "p05", "median", "p95"}}.
+    """
+    sensor = get_sensor_meta(sensor_name)
+    if not sensor:
+        return {}
+
+    history = db.session.get(LocationHistory, deployment_id) if deployment_id else None
+    if history is not None and history.sensor_id != sensor.id:
+        history = None
+    if history is not None:
+        start_date, end_date = history.deployed_at, history.removed_at
+
+    closed = history is not None and history.removed_at is not None
+    if closed:
+        cached = (
+            db.session.query(DeploymentStats, Parameter.name, Parameter.canonical_unit)
+            .join(Parameter, DeploymentStats.parameter_id == Parameter.id)
+            .filter(DeploymentStats.deployment_id == history.id)
+            .all()
+        )
+        if cached:
+            return {
+                name: {
+                    "unit": unit, "count": row.count, "mean": row.mean, "min": row.min, "max": row.max,
+                    "stddev": row.stddev, "p05": row.p05, "median": row.median, "p95": row.p95,
+                }
+                for row, name, unit in cached
+            }
+
+    from server.archive import get_archived_stats
+
+    end_date = end_date or datetime.utcnow()
+    health_ids = parameter_registry.ids_for(HEALTH_PARAMS)
+    totals = _window_stats(sensor.id, start_date, end_date, health_ids)
+    for parameter_id, agg in get_archived_stats(sensor.id, start_date, end_date, health_ids).items():
+        totals[parameter_id] = _merge_stats(totals[parameter_id], agg) if parameter_id in totals else agg
+
+    if not totals:
+        return {}
+
+    params = db.session.query(Parameter.id, Parameter.name, Parameter.canonical_unit) \
+        .filter(Parameter.id.in_(list(totals))).all()
+
+    results = {}
+    for param in params:
+        count, mean, m2, low, high, percentiles = totals[param.id]
+        p05, median, p95 = percentiles or (None, None, None)
+        results[param.name] = {
+            "unit": param.canonical_unit, "count": count, "mean": mean, "min": low, "max": high,
+            "stddev": (m2 / (count - 1)) ** 0.5 if count > 1 else 0.0,
+            "p05": p05, "median": median, "p95": p95,
+        }
+
+    if closed:
+        stored = [
+            dict(stats, deployment_id=history.id, parameter_id=param.id)
+            for param in params
+            for stats in [{k: v for k, v in results[param.name].items() if k != "unit"}]
+        ]
+        try:
+            stmt = dialect_insert(DeploymentStats.__table__)
+            if stmt is not None:
+                # Another worker may have stored the same deployment meanwhile
+                db.session.execute(stmt.on_conflict_do_nothing(), stored)
+            else:
+                db.session.add_all([DeploymentStats(**row) for row in stored])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error caching deployment statistics: {e}")
+
+    return results
+
+@request_memo
 def get_parameters(sensor_name):
     """
     Used to populate the 'Update Sensor' form.
     """
-    sensor = get_sensor_by_name(sensor_name)
+    sensor = get_sensor_meta(sensor_name)
     if not sensor:
         return []
 
-    # Find all parameter IDs this sensor has data for
+    # Find all parameter IDs this sensor has data for (one sensor_latest row
+    # each, instead of a DISTINCT over every partition of sensor_data)
     param_ids = (
-        db.session.query(SensorData.parameter_id)
-        .filter(SensorData.sensor_id == sensor.id)
-        .distinct()
+        db.session.query(SensorLatest.parameter_id)
+        .filter(SensorLatest.sensor_id == sensor.id)
     )
 
     params = (
@@ -253,30 +824,34 @@ def get_parameters(sensor_name):
     )
     return params
 
+@request_memo
 def get_most_recent(sensor_name, Lora = False):
-
-    sensor = get_sensor_by_name(sensor_name)
+    """
+    Readings from the sensor's latest uplink as (SensorLatest, name, unit).
+    SensorLatest has the same timestamp/value attributes as SensorData.
+    """
+    sensor = get_sensor_meta(sensor_name)
     if not sensor:
         return []
 
-    latest_ts = db.session.query(func.max(SensorData.timestamp)) \
-        .filter_by(sensor_id=sensor.id).scalar()
+    # A handful of rows per sensor; pick the latest uplink in Python
+    latest = (
+        db.session.query(SensorLatest, Parameter.name, Parameter.canonical_unit) \
+        .join(Parameter, SensorLatest.parameter_id == Parameter.id) \
+        .filter(SensorLatest.sensor_id == sensor.id) \
+        .all()
+        )
 
-    if not latest_ts:
+    if not latest:
         return []
 
-    query = (
-        db.session.query(SensorData, Parameter.name, Parameter.canonical_unit) \
-        .join(Parameter, SensorData.parameter_id == Parameter.id) \
-        .filter(SensorData.sensor_id == sensor.id) \
-        .filter(SensorData.timestamp == latest_ts) \
-        )
-
-    if Lora:
-        recent_data = query.filter(Parameter.name.in_(HEALTH_PARAMS)).all()
-    else:
-        recent_data = query.filter(~Parameter.name.in_(HEALTH_PARAMS)).all()
+    latest_ts = max(row[0].timestamp for row in latest)
+    health_ids = set(parameter_registry.ids_for(HEALTH_PARAMS))
 
+    recent_data = [
+        row for row in latest
+        if row[0].timestamp == latest_ts and (row[0].parameter_id in health_ids) == Lora
+    ]
     return recent_data
 
 def create_or_update_sensor(name,
@@ -380,24 +955,27 @@ def create_or_update_sensor(name,
         sensor.active = active
 
         if image_data:
-            sensor.image_data = compress_image(image_data)
+            db.session.flush()  # New sensors need their id
+            save_sensor_image(sensor.id, image_data)
 
         if not action:
             action = 'updated'
 
         db.session.commit()
+        sensor_cache.invalidate()
         return f"Sensor '{name}' {action} successfully."
     except Exception as e:
         db.session.rollback()
         return f"Database Error: {str(e)}"
 
+@request_memo
 def get_past_deployments(sensor_name):
     """
     Fetches location history for a specific sensor.
     Returns a list of dicts with formatted dates and coordinates.
     """
 
-    sensor = get_sensor_by_name(sensor_name)
+    sensor = get_sensor_meta(sensor_name)
     if not sensor:
         return []
 
@@ -427,6 +1005,7 @@ def get_past_deployments(sensor_name):
             end_iso = None
 
         deployments.append({
+            "id": record.id,
             "site_name": f"Deployment: {start_fmt}",
             "range": f"{start_fmt} - {end_fmt}",
             "duration": duration,
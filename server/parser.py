@@ -1,7 +1,11 @@
 from datetime import datetime
 import pytz
 import base64
+import json
 import struct
+import time
+import numpy as np
+from dateutil.parser import parse as parse_date
 
 def parse_lora_message(sensor_data):
     """
@@ -33,6 +37,117 @@ def parse_lora_message(sensor_data):
         print(f"Lora parsing error: {e}")
         return None
 
+class IridiumLayout:
+    """
+    Binary layout of an Iridium SBD payload, declared as data and compiled
+    once into a struct.Struct and a NumPy structured dtype.
+
+    Tagged layouts (tags given) are header_size bytes followed by repeated
+    <tag:uint8><value> records; tags maps tag number -> parameter name and
+    unknown tags are ignored. Fixed layouts (fields given) are header_size
+    bytes followed by one record of (parameter name, struct code) fields.
+    """
+
+    def __init__(self, name, header_size=2, tags=None, fields=None, value_code='f'):
+        self.name = name
+        self.header_size = header_size
+        self.tagged = fields is None
+        if self.tagged:
+            self.tags = {int(tag): param for tag, param in (tags or {}).items()}
+            self.record = struct.Struct('<B' + value_code)
+            self.dtype = np.dtype([('tag', 'u1'), ('value', '<' + value_code)])
+        else:
+            self.names = [field[0] for field in fields]
+            self.record = struct.Struct('<' + ''.join(field[1] for field in fields))
+            self.dtype = np.dtype([(field[0], '<' + field[1]) for field in fields])
+
+    def _count(self, raw):
+        """Number of whole records after the header."""
+        return max((len(raw) - self.header_size) // self.record.size, 0)
+
+    def decode(self, raw):
+        """Decodes one message into a {parameter: value} dict in one pass."""
+        count = self._count(raw)
+        if not count:
+            return {}
+        body = raw[self.header_size:self.header_size + count * self.record.size]
+        if self.tagged:
+            tags = self.tags
+            return {tags[tag]: value for tag, value in self.record.iter_unpack(body) if tag in tags}
+        return dict(zip(self.names, self.record.unpack_from(body)))
+
+    def decode_many(self, raws):
+        """
+        Decodes many messages at once. Messages with the same record count are
+        stacked into one 2-D array with np.frombuffer; when they also share the
+        same tag sequence (the usual case for one device type) the parameter
+        names are resolved once for the whole group.
+        Returns one {parameter: value} dict per message, in input order.
+        """
+        results = [None] * len(raws)
+        groups = {}
+        for index, raw in enumerate(raws):
+            groups.setdefault(self._count(raw), []).append(index)
+
+        size = self.record.size
+        start, tags = self.header_size, getattr(self, 'tags', None)
+        for count, indexes in groups.items():
+            if not count:
+                for index in indexes:
+                    results[index] = {}
+                continue
+
+            buffer = b''.join(raws[i][start:start + count * size] for i in indexes)
+            records = np.frombuffer(buffer, dtype=self.dtype).reshape(len(indexes), count)
+
+            if not self.tagged:
+                for index, row in zip(indexes, records.tolist()):
+                    results[index] = dict(zip(self.names, row[0]))
+                continue
+
+            tag_rows = records['tag']
+            if (tag_rows == tag_rows[0]).all():
+                keep = [col for col, tag in enumerate(tag_rows[0].tolist()) if tag in tags]
+                names = [tags[int(tag_rows[0][col])] for col in keep]
+                for index, values in zip(indexes, records['value'][:, keep].tolist()):
+                    results[index] = dict(zip(names, values))
+            else:
+                for index, tag_row, values in zip(indexes, tag_rows.tolist(), records['value'].tolist()):
+                    results[index] = {tags[tag]: value for tag, value in zip(tag_row, values) if tag in tags}
+
+        return results
+
+
+# Layout used by the deployed sondes
+IRIDIUM_LAYOUTS = {
+    "default": IridiumLayout("default", header_size=2, tags={
+        1: "dissolved_oxygen",
+        2: "conductivity",
+        3: "pH",
+        4: "temperature",
+        5: "humidity",
+    }),
+}
+
+# IMEI -> layout name, for devices that do not use the default layout
+IRIDIUM_DEVICE_LAYOUTS = {}
+
+def load_iridium_layouts(path):
+    """
+    Registers extra layouts from a JSON file so new devices need no code changes:
+        {"layouts": {"name": {"header_size": 2, "tags": {"1": "temperature"}}
+                     "name2": {"header_size": 4, "fields": [["depth", "f"], ["battery", "H"]]}},
+         "devices": {"300434063000000": "name"}}
+    """
+    with open(path) as f:
+        config = json.load(f)
+    for name, spec in config.get('layouts', {}).items():
+        IRIDIUM_LAYOUTS[name] = IridiumLayout(name, **spec)
+    IRIDIUM_DEVICE_LAYOUTS.update({str(imei): name for imei, name in config.get('devices', {}).items()})
+
+def get_iridium_layout(imei):
+    return IRIDIUM_LAYOUTS[IRIDIUM_DEVICE_LAYOUTS.get(str(imei), "default")]
+
 def parse_iridium_message(sensor_data):
     """
     Parses Iridium JSON payloads.
@@ -62,53 +177,154 @@ def parse_iridium_message(sensor_data):
 
         #Decode payload
         b64_string = sensor_data.get('data') or sensor_data.get('message')
-        print(f"Raw Payload: {b64_string}")
 
         payload = {}
         payload['timestamp'] = timestamp
         if b64_string:
             try:
                 raw = base64.b64decode(b64_string)
+                payload.update(get_iridium_layout(imei).decode(raw))
+            except Exception as e:
+                print(f"Binary Decoding Failed: {e}")
 
-                # Check if there is more than a header
-                if len(raw) >= 2:
+        return {
+            "sensor_name": sensor_name,
+            "measurements": payload,
+            "lat": lat,
+            "lon": lon
+        }
 
-                    # Start at index 2 to skip the header bytes
-                    i = 2
+    except Exception as e:
+        print(f"Iridium Parsing Error: {e}")
+        return None
 
-                    # Loop while we have at least 5 bytes remaining (1 tag + 4 float)
-                    while i <= len(raw) - 5:
-                        tag = raw[i]
 
-                        value = struct.unpack('<f', raw[i + 1: i + 5])[0]
+def parse_time(value):
+    """Unix seconds, ISO string or None (receive time) -> datetime."""
+    if value is None:
+        return datetime.utcnow().replace(tzinfo=pytz.utc)
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    return parse_date(value)
 
-                        # Tags
-                        if tag == 1:
-                            payload['dissolved_oxygen'] = value
-                        elif tag == 2:
-                            payload['conductivity'] = value
-                        elif tag == 3:
-                            payload['pH'] = value
-                        elif tag == 4:
-                            payload['temperature'] = value
-                        elif tag == 5:
-                            payload['humidity'] = value
+def parse_ttn_v3_message(sensor_data):
+    """
+    Parses The Things Network v3 uplink webhooks.
+    """
+    try:
+        sensor_name = sensor_data['end_device_ids']['device_id']
+        uplink = sensor_data['uplink_message']
 
-                        # Move to next block (1 byte tag + 4 bytes float = 5 bytes)
-                        i += 5
-                else:
-                    print("Payload too short for header")
+        payload = dict(uplink.get('decoded_payload') or {})
+        rx_info = (uplink.get('rx_metadata') or [{}])[0]
+        payload['rssi'] = rx_info.get('rssi')
+        payload['snr'] = rx_info.get('snr')
+        payload['timestamp'] = parse_time(payload.get('timestamp') or uplink.get('received_at'))
 
-            except Exception as e:
-                print(f"Binary Decoding Failed: {e}")
+        return {
+            "sensor_name": sensor_name,
+            "measurements": payload,
+            "lat": None,
+            "lon": None
+        }
+    except Exception as e:
+        print(f"TTN parsing error: {e}")
+        return None
+
+def parse_chirpstack_v3_message(sensor_data):
+    """
+    Parses raw ChirpStack v3 uplink events (deviceName at the top level).
+    """
+    try:
+        sensor_name = sensor_data['deviceName']
+        rx_info = (sensor_data.get('rxInfo') or [{}])[0]
+
+        payload = dict(sensor_data.get('object') or {})
+        payload['rssi'] = rx_info.get('rssi')
+        payload['snr'] = rx_info.get('loRaSNR')
+        payload['timestamp'] = parse_time(payload.get('timestamp') or rx_info.get('time'))
 
         return {
             "sensor_name": sensor_name,
             "measurements": payload,
-            "lat": lat,
-            "lon": lon
+            "lat": None,
+            "lon": None
         }
+    except Exception as e:
+        print(f"ChirpStack parsing error: {e}")
+        return None
 
+def parse_cellular_message(sensor_data):
+    """
+    Parses cellular logger posts:
+        {"logger": "name", "timestamp": unix or ISO, "lat": .., "lon": .., "measurements": {...}}
+    """
+    try:
+        payload = dict(sensor_data.get('measurements') or {})
+        payload['timestamp'] = parse_time(sensor_data.get('timestamp'))
+
+        return {
+            "sensor_name": sensor_data['logger'],
+            "measurements": payload,
+            "lat": sensor_data.get('lat'),
+            "lon": sensor_data.get('lon')
+        }
     except Exception as e:
-        print(f"Iridium Parsing Error: {e}")
-        return None
\ No newline at end of file
+        print(f"Cellular parsing error: {e}")
+        return None
+
+
+class ParserRegistry:
+    """
+    Payload formats and their parsers.
+
+    Every parser returns the same record: {"sensor_name", "measurements"
+    (parameter -> value plus "timestamp"), "lat", "lon"}, or None on failure.
+    Dispatch is a dict lookup: on the format name when the caller knows it
+    (route path or X-Payload-Format header), otherwise on the top-level key
+    that identifies the format. Per-format parse counts, failures and parse
+    time are kept for /ingest/stats.
+    """
+
+    def __init__(self):
+        self.parsers = {}
+        self.signatures = {}   # top-level key -> (priority, format)
+        self.stats = {}
+
+    def register(self, fmt, parser, signature_key=None):
+        self.parsers[fmt] = parser
+        if signature_key:
+            self.signatures[signature_key] = (len(self.signatures), fmt)
+        self.stats[fmt] = {"parsed": 0, "failed": 0, "parse_seconds": 0.0}
+
+    def detect(self, sensor_data):
+        """Format name for a payload, or None. Earlier registrations win ties."""
+        matches = self.signatures.keys() & sensor_data.keys()
+        if not matches:
+            return None
+        return min(self.signatures[key] for key in matches)[1]
+
+    def parse(self, sensor_data, fmt=None):
+        """Returns (format, record). record is None if the parser failed."""
+        fmt = fmt or self.detect(sensor_data)
+        parser = self.parsers.get(fmt)
+        if parser is None:
+            return None, None
+
+        started = time.perf_counter()
+        record = parser(sensor_data)
+        stats = self.stats[fmt]
+        stats["parse_seconds"] += time.perf_counter() - started
+        if record:
+            stats["parsed"] += 1
+        else:
+            stats["failed"] += 1
+        return fmt, record
+
+
+parsers = ParserRegistry()
+parsers.register("lora", parse_lora_message, signature_key="deviceInfo")
+parsers.register("iridium", parse_iridium_message, signature_key="id")
+parsers.register("ttn_v3", parse_ttn_v3_message, signature_key="end_device_ids")
+parsers.register("chirpstack_v3", parse_chirpstack_v3_message, signature_key="deviceName")
+parsers.register("cellular", parse_cellular_message, signature_key="logger")
@@ -0,0 +1,186 @@
+from datetime import datetime
+from sqlalchemy import text
+from .database import db
+from .socketio import socketio
+
+# Monthly range partitioning of sensor_data on Postgres.
+#
+# `flask partition-sensor-data` converts the table once; afterwards each month
+# lives in sensor_data_YYYY_MM and Postgres prunes partitions for queries with
+# timestamp bounds (get_data always has them). Future months are created ahead
+# of time by a maintenance greenlet, and sensor_data_default catches anything
+# outside the covered months so ingest never fails. Old months are archived by
+# detaching their partition. SQLite and unconverted databases keep the plain
+# single table and none of this runs.
+
+PARENT = 'sensor_data'
+DEFAULT_PARTITION = 'sensor_data_default'
+
+
+def month_start(timestamp):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month):
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+def partition_name(month):
+    return f"{PARENT}_{month.year:04d}_{month.month:02d}"
+
+def parse_month(value):
+    """'YYYY-MM' -> datetime of the first of that month."""
+    return datetime.strptime(value, '%Y-%m')
+
+
+def is_supported():
+    return db.engine.dialect.name == 'postgresql'
+
+def is_partitioned():
+    if not is_supported():
+        return False
+    return db.session.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :parent AND pg_table_is_visible(c.oid)
+        )
+    """), {'parent': PARENT}).scalar()
+
+def list_partitions():
+    """Names of the attached partitions, oldest month first (default last)."""
+    rows = db.session.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :parent AND pg_table_is_visible(p.oid)
+        ORDER BY c.relname
+    """), {'parent': PARENT}).scalars().all()
+    return sorted(rows, key=lambda name: name == DEFAULT_PARTITION)
+
+
+def create_partition(month):
+    """
+    Creates and attaches the partition for one month. Rows for that month that
+    already landed in the default partition are moved into it first, since
+    Postgres refuses to attach a range the default partition holds rows for.
+    Returns False if the partition already exists. The caller commits.
+    """
+    name = partition_name(month)
+    if name in list_partitions():
+        return False
+
+    bounds = {'start': month, 'end': next_month(month)}
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    db.session.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= :start AND timestamp < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds)
+    # Matching indexes are created on the new partition by ATTACH
+    db.session.execute(text(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+    ))
+    return True
+
+def ensure_partitions(months_ahead=3, now=None):
+    """Creates partitions from the current month through months_ahead. Returns the names created."""
+    month = month_start(now or datetime.utcnow())
+    created = []
+    for _ in range(months_ahead + 1):
+        if create_partition(month):
+            created.append(partition_name(month))
+        month = next_month(month)
+    db.session.commit()
+    return created
+
+def detach_partitions(before):
+    """
+    Detaches every monthly partition older than the month `before`. The
+    detached tables keep their rows as ordinary tables (dump or drop them to
+    archive); queries on sensor_data no longer see them.
+    Returns the names detached.
+    """
+    cutoff = partition_name(month_start(before))
+    detached = []
+    for name in list_partitions():
+        if name != DEFAULT_PARTITION and name < cutoff:
+            db.session.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            detached.append(name)
+    db.session.commit()
+    return detached
+
+
+def migrate_to_partitioned(months_ahead=3):
+    """
+    Rebuilds sensor_data as a table partitioned by month on timestamp and
+    copies the existing rows in one transaction. The primary key becomes
+    (id, timestamp) because Postgres requires the partition key in every
+    unique constraint; idx_sensor_param_time already includes it.
+    The old table is kept as sensor_data_unpartitioned until dropped by hand.
+    """
+    statements = [
+        f"ALTER TABLE {PARENT} RENAME TO {PARENT}_unpartitioned",
+        f"ALTER TABLE {PARENT}_unpartitioned RENAME CONSTRAINT {PARENT}_pkey TO {PARENT}_unpartitioned_pkey",
+        "ALTER INDEX IF EXISTS idx_sensor_param_time RENAME TO idx_sensor_param_time_unpartitioned",
+        f"ALTER INDEX IF EXISTS ix_{PARENT}_timestamp RENAME TO ix_{PARENT}_timestamp_unpartitioned",
+        f"""CREATE TABLE {PARENT} (
+                id integer NOT NULL DEFAULT nextval('{PARENT}_id_seq'),
+                timestamp timestamp without time zone NOT NULL,
+                value double precision NOT NULL,
+                sensor_id integer NOT NULL REFERENCES sensors (id),
+                parameter_id integer NOT NULL REFERENCES parameters (id),
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)""",
+        f"ALTER SEQUENCE {PARENT}_id_seq OWNED BY {PARENT}.id",
+        f"CREATE UNIQUE INDEX idx_sensor_param_time ON {PARENT} (sensor_id, parameter_id, timestamp)",
+        f"CREATE INDEX ix_{PARENT}_timestamp ON {PARENT} (timestamp)",
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    first, last = db.session.execute(text(
+        f"SELECT min(timestamp), max(timestamp) FROM {PARENT}_unpartitioned"
+    )).one()
+    month = month_start(first or datetime.utcnow())
+    end = month_start(max(last or datetime.utcnow(), datetime.utcnow()))
+    for _ in range(months_ahead):
+        end = next_month(end)
+
+    while month <= end:
+        db.session.execute(text(
+            f"CREATE TABLE {partition_name(month)} PARTITION OF {PARENT} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+        ))
+        month = next_month(month)
+
+    result = db.session.execute(text(f"""
+        INSERT INTO {PARENT} (id, timestamp, value, sensor_id, parameter_id)
+        SELECT id, timestamp, value, sensor_id, parameter_id FROM {PARENT}_unpartitioned
+    """))
+    db.session.commit()
+    return result.rowcount
+
+
+def start_maintenance(app, months_ahead=3, interval_seconds=24 * 3600):
+    """Keeps months_ahead future partitions in place while the server runs."""
+    def run():
+        with app.app_context():
+            while True:
+                try:
+                    if is_partitioned():
+                        created = ensure_partitions(months_ahead)
+                        if created:
+                            print(f"Created sensor_data partitions: {', '.join(created)}")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Partition maintenance error: {e}")
+                finally:
+                    db.session.remove()
+                socketio.sleep(interval_seconds)
+
+    socketio.start_background_task(run)
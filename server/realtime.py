@@ -1,8 +1,53 @@
+from flask import request
+from flask_socketio import join_room, leave_room, rooms
 from .socketio import socketio
 
-def emit_event(event_name, payload):
+FLEET_ROOM = 'fleet'
+
+def sensor_room(sensor_name):
+    return f"sensor:{sensor_name}"
+
+def emit_event(event_name, payload, room=None):
     """
     Emit arbitrary payloads over WebSocket.
     Payload is assumed to already be JSON-serializable.
+    With room=None the event is broadcast to every client.
+    """
+    socketio.emit(event_name, payload, namespace='/', to=room)
+
+def emit_sensor_update(sensor_name, timestamp, measurements):
+    """
+    Sends the full update only to clients viewing this sensor, and a small
+    status ping to the fleet room (home page map).
     """
-    socketio.emit(event_name, payload, namespace='/')
+    emit_event("sensor_update", {
+        "sensor": sensor_name,
+        "timestamp": timestamp.isoformat(),
+        "measurements": measurements
+    }, room=sensor_room(sensor_name))
+    emit_event("fleet_update", {
+        "sensor": sensor_name,
+        "timestamp": timestamp.isoformat()
+    }, room=FLEET_ROOM)
+
+# Clients say which page they are on; each client is in at most one room.
+def _leave_current_rooms():
+    for room in rooms():
+        if room != request.sid:
+            leave_room(room)
+
+@socketio.on('join_sensor')
+def on_join_sensor(data):
+    _leave_current_rooms()
+    sensor_name = (data or {}).get('sensor')
+    if sensor_name:
+        join_room(sensor_room(sensor_name))
+
+@socketio.on('join_fleet')
+def on_join_fleet(data=None):
+    _leave_current_rooms()
+    join_room(FLEET_ROOM)
+
+@socketio.on('leave_rooms')
+def on_leave_rooms(data=None):
+    _leave_current_rooms()
@@ -0,0 +1,197 @@
+from sqlalchemy import func, insert, select, delete, literal_column, or_
+from sqlalchemy.orm import aliased
+from .database import db, dialect_insert
+from .models import Sensor, SensorData, SensorLatest, ArchivedRange, ROLLUP_MODELS, bucket_start, bucket_end
+
+# Tables derived from SensorData: hourly/daily rollups and the latest value
+# per sensor and parameter. The update_* functions run inside the ingest
+# transaction with the rows that were actually inserted, so retransmits are
+# never counted twice; the rebuild_* functions recompute from the raw table.
+
+
+def _least_greatest():
+    # SQLite's multi-argument min()/max() are its LEAST/GREATEST
+    if db.engine.dialect.name == 'sqlite':
+        return func.min, func.max
+    return func.least, func.greatest
+
+def update_rollups(rows):
+    """
+    Folds newly inserted SensorData rows into every rollup table.
+
+    Args:
+        rows (list): (sensor_id, parameter_id, timestamp, value) tuples, as
+                     returned by insert_rows.
+    """
+    if not rows:
+        return
+
+    least, greatest = _least_greatest()
+    for resolution, model in ROLLUP_MODELS.items():
+        groups = {}
+        for sensor_id, parameter_id, timestamp, value in rows:
+            key = (sensor_id, parameter_id, bucket_start(timestamp, resolution))
+            agg = groups.get(key)
+            if agg is None:
+                groups[key] = [1, value, value, value]
+            else:
+                agg[0] += 1
+                agg[1] += value
+                agg[2] = min(agg[2], value)
+                agg[3] = max(agg[3], value)
+
+        table = model.__table__
+        stmt = dialect_insert(table)
+        if stmt is None:
+            print("Rollups need Postgres or SQLite upserts; run `flask rebuild-rollups` instead.")
+            return
+
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['sensor_id', 'parameter_id', 'bucket'],
+            set_={
+                'count': table.c['count'] + excluded['count'],
+                'sum': table.c['sum'] + excluded['sum'],
+                'min': least(table.c['min'], excluded['min']),
+                'max': greatest(table.c['max'], excluded['max']),
+            }
+        )
+        db.session.execute(stmt, [
+            {'sensor_id': sensor_id, 'parameter_id': parameter_id, 'bucket': bucket,
+             'count': count, 'sum': total, 'min': low, 'max': high}
+            for (sensor_id, parameter_id, bucket), (count, total, low, high) in groups.items()
+        ])
+
+
+def _bucket_expression(resolution, column):
+    """SQL for bucket_start(). Matches how each dialect stores DateTime."""
+    if db.engine.dialect.name == 'postgresql':
+        # Literal, not a bind parameter, so GROUP BY matches the selected expression
+        return func.date_trunc(literal_column("'day'" if resolution == 'daily' else "'hour'"), column)
+    # SQLAlchemy stores SQLite datetimes as 'YYYY-MM-DD HH:MM:SS.ffffff'
+    fmt = '%Y-%m-%d 00:00:00.000000' if resolution == 'daily' else '%Y-%m-%d %H:00:00.000000'
+    return func.strftime(fmt, column)
+
+def rebuild_rollups(sensor_id):
+    """
+    Recomputes every rollup for one sensor from its raw rows with one
+    INSERT ... SELECT ... GROUP BY per table. The caller commits.
+    Buckets before the oldest row in the database, and buckets overlapping a
+    span archived to Parquet (ArchivedRange), are kept as they are: their
+    raw rows are no longer all in the database.
+    """
+    first_ts = db.session.query(func.min(SensorData.timestamp)) \
+        .filter(SensorData.sensor_id == sensor_id).scalar()
+    if first_ts is None:
+        return
+
+    archived = db.session.query(ArchivedRange.start, ArchivedRange.end) \
+        .filter(ArchivedRange.sensor_id == sensor_id).all()
+
+    for resolution, model in ROLLUP_MODELS.items():
+        table = model.__table__
+        bucket = _bucket_expression(resolution, SensorData.timestamp)
+        spans = [(bucket_start(start, resolution), bucket_end(end, resolution)) for start, end in archived]
+
+        db.session.execute(
+            delete(table)
+            .where(table.c.sensor_id == sensor_id)
+            .where(table.c.bucket >= bucket_start(first_ts, resolution))
+            .where(*[or_(table.c.bucket < low, table.c.bucket >= high) for low, high in spans])
+        )
+        db.session.execute(
+            insert(table).from_select(
+                ['sensor_id', 'parameter_id', 'bucket', 'count', 'sum', 'min', 'max'],
+                select(
+                    SensorData.sensor_id,
+                    SensorData.parameter_id,
+                    bucket,
+                    func.count(SensorData.value),
+                    func.sum(SensorData.value),
+                    func.min(SensorData.value),
+                    func.max(SensorData.value),
+                )
+                .where(SensorData.sensor_id == sensor_id)
+                .where(*[or_(SensorData.timestamp < low, SensorData.timestamp >= high) for low, high in spans])
+                .group_by(SensorData.sensor_id, SensorData.parameter_id, bucket)
+            )
+        )
+
+
+def update_latest(rows):
+    """
+    Upserts the newest of the inserted rows per (sensor, parameter) into
+    sensor_latest, keeping the stored row when it is newer (late backfills).
+    """
+    if not rows:
+        return
+
+    newest = {}
+    for sensor_id, parameter_id, timestamp, value in rows:
+        key = (sensor_id, parameter_id)
+        if key not in newest or timestamp >= newest[key][0]:
+            newest[key] = (timestamp, value)
+
+    table = SensorLatest.__table__
+    stmt = dialect_insert(table)
+    if stmt is None:
+        print("sensor_latest needs Postgres or SQLite upserts; run `flask rebuild-latest` instead.")
+        return
+
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['sensor_id', 'parameter_id'],
+        set_={'timestamp': excluded.timestamp, 'value': excluded.value},
+        where=excluded.timestamp >= table.c.timestamp
+    )
+    db.session.execute(stmt, [
+        {'sensor_id': sensor_id, 'parameter_id': parameter_id, 'timestamp': timestamp, 'value': value}
+        for (sensor_id, parameter_id), (timestamp, value) in newest.items()
+    ])
+
+def rebuild_latest(sensor_id):
+    """
+    Recomputes sensor_latest for one sensor from its raw rows. The caller commits.
+    One row per parameter (the highest id among its newest rows), so
+    duplicate raw rows left from before the unique index do not conflict.
+    """
+    table = SensorLatest.__table__
+    newer = aliased(SensorData)
+    latest_id = (
+        select(newer.id)
+        .where(newer.sensor_id == SensorData.sensor_id)
+        .where(newer.parameter_id == SensorData.parameter_id)
+        .order_by(newer.timestamp.desc(), newer.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    db.session.execute(delete(table).where(table.c.sensor_id == sensor_id))
+    db.session.execute(
+        insert(table).from_select(
+            ['sensor_id', 'parameter_id', 'timestamp', 'value'],
+            select(SensorData.sensor_id, SensorData.parameter_id, SensorData.timestamp, SensorData.value)
+            .where(SensorData.sensor_id == sensor_id)
+            .where(SensorData.id == latest_id)
+        )
+    )
+
+def backfill_latest():
+    """
+    Fills sensor_latest from sensor_data when it is empty (first start after
+    upgrading), one sensor per commit. Returns the number of sensors filled.
+    """
+    if db.session.query(SensorLatest.sensor_id).first() is not None:
+        return 0
+
+    filled = 0
+    for (sensor_id,) in db.session.query(Sensor.id).all():
+        try:
+            rebuild_latest(sensor_id)
+            db.session.commit()
+            filled += 1
+        except Exception as e:
+            # e.g. another worker filling the same sensor at startup
+            db.session.rollback()
+            print(f"Could not fill sensor_latest for sensor {sensor_id}: {e}")
+    return filled
@@ -1,126 +1,382 @@
-from flask import request, jsonify
-from .models import (Parameter,
-                     SensorData,
-                     get_sensor_by_name,
-                     HEALTH_PARAMS,
-                     get_param_by_name)
-from .database import db
-from .realtime import emit_event
-from server.parser import parse_lora_message, parse_iridium_message
-
-
-# Helper function to guess unit
-def guess_unit(param_name):
-    param = param_name.lower()
-    PARAMETER_UNITS = {
-        "temperature": "°C",
-        "pressure": "Pa",
-        "humidity": "%",
-        "velocity": "m/s",
-        "acceleration": "m/s\u00B2",
-        "water_level": "m",
-        "wave_height": "m",
-        "depth": "m",
-        "dissolved_oxygen": "mg/L",
-        "conductivity": "µS/cm",
-        "turbidity": "NTU",
-        "ph": "",
-        "rssi": "dBm",
-        "snr": "dB",
-        "battery": "V",
-    }
-    return PARAMETER_UNITS.get(param, "")
+from flask import request, jsonify, current_app, Response, stream_with_context
+from werkzeug.utils import secure_filename
+from dateutil.parser import parse as parse_date
+from datetime import datetime, timedelta
+import base64
+import gzip
+import hashlib
+import json
+import pytz
+import queue
+import time
+from .models import get_sensor_meta, get_sensor_image, get_sensors_grouped_by_type, get_data_page
+from .ingest import parse_uplink, store_payloads, ingest_queue, dedup_stats, recent_keys
+from .cache import data_cache
+from .spool import spool
+from .parser import parsers
+from .export import iter_export, iter_bulk_zip, gzip_chunks, EXPORT_FORMATS
+from . import metrics
+
+
+# Read API cursors: the (timestamp, parameter_id) of the last row returned,
+# opaque to clients
+def encode_cursor(timestamp, parameter_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{parameter_id}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(timestamp, parameter_id) from a cursor. Raises ValueError when malformed."""
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    timestamp, parameter_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(parameter_id)
+
+def parse_utc(value):
+    """ISO 8601 date/time as naive UTC. Times without an offset are taken as UTC."""
+    parsed = parse_date(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.utc).replace(tzinfo=None)
+    return parsed
 
 def setup_routes(server):
     @server.route('/receive_data', methods=['POST'])
-    def receive_data():
+    @server.route('/receive_data/<fmt>', methods=['POST'])
+    def receive_data(fmt=None):
         sensor_data = request.json
         if not sensor_data:
             return jsonify({'error': 'No JSON payload received'}), 400
 
-        payload = None
+        #Format from the route path or header skips detection
+        fmt = fmt or request.headers.get('X-Payload-Format')
+        payload, sensor, error = parse_uplink(sensor_data, fmt)
+        if error:
+            #A parsed payload without a sensor: device not onboarded
+            return jsonify({'error': error}), 403 if payload else 400
 
-        #LoRaWAN message
-        if 'deviceInfo' in sensor_data:
-            payload = parse_lora_message(sensor_data)
-        #Iridium message
-        elif 'id' in sensor_data:
-            payload = parse_iridium_message(sensor_data)
-        else:
-            return jsonify({'error': 'Unknown payload format'}), 400
+        #Spool mode: durably appended locally, the replay worker commits and emits
+        if current_app.config.get('INGEST_MODE') == 'spool':
+            spool.append(payload)
+            return jsonify({'message': 'Data accepted'}), 202
+
+        #Queued mode: the background writer commits and emits
+        if current_app.config.get('INGEST_MODE') == 'queue':
+            try:
+                ingest_queue.put(payload, sensor)
+            except queue.Full:
+                return jsonify({'error': 'Ingest queue full, retry later'}), 503
+            return jsonify({'message': 'Data accepted'}), 202
 
-        if not payload:
-            return jsonify({'error': 'Parsing failed or empty data'}), 400
+        #Data Ingestion
+        try:
+            result = store_payloads([(payload, sensor)])[0]
+        except Exception as e:
+            print(f"Database insert error: {e}")
+            return jsonify({"error": "Database error, data not stored"}), 500
 
-        #Reject messages from devices that have not been onboarded
-        sensor_name = payload['sensor_name']
-        sensor = get_sensor_by_name(sensor_name)
+        if not isinstance(result, int):
+            return jsonify({'error': result}), 400
 
-        if not sensor:
-            return jsonify({'error': f"Device '{sensor_name}' not onboarded."}), 403
+        return jsonify({'message': 'Data received and stored successfully'}), 200
 
-        #Data prep. Handle lat and long (not reported by LoRaWAN sensors)
-        measurements = payload['measurements']
-        timestamp = measurements.get('timestamp')
-        lat = payload.get('lat') #handle missing data gracefully
-        lon = payload.get('lon')
+    @server.route('/receive_data/batch', methods=['POST'])
+    def receive_data_batch():
+        """
+        Accepts a JSON array of LoRa/Iridium uplinks (e.g. a gateway backfill)
+        and stores every accepted uplink with one bulk insert and one commit.
+        """
+        uplinks = request.json
+        if not isinstance(uplinks, list) or not uplinks:
+            return jsonify({'error': 'Expected a non-empty JSON array of uplinks'}), 400
 
-        #Update Sensor table (map pin updates from this)
-        if lat is not None and lon is not None:
-            sensor.latitude = float(lat)
-            sensor.longitude = float(lon)
+        max_items = current_app.config['INGEST_BATCH_MAX_ITEMS']
+        if len(uplinks) > max_items:
+            return jsonify({'error': f"Batch too large ({len(uplinks)} > {max_items} uplinks)"}), 413
 
-        #Add lat/lon to measurements to store in SensorData and track over time
-        if lat is not None:
-            measurements['latitude'] = float(lat)
-            measurements['longitude'] = float(lon)
+        started = time.perf_counter()
 
-        #Data Ingestion
-        new_data = [] #dictionary to emit
+        fmt = request.headers.get('X-Payload-Format')
+        results = [None] * len(uplinks)
+        items = []
+        item_indexes = []
 
-        for param_name, param_value in measurements.items():
-            if param_name.lower() == 'timestamp':
+        for index, sensor_data in enumerate(uplinks):
+            payload, sensor, error = parse_uplink(sensor_data, fmt)
+            if error:
+                results[index] = {'index': index, 'status': 'rejected', 'error': error}
                 continue
 
-            if param_value is None:
-                continue
+            items.append((payload, sensor))
+            item_indexes.append(index)
 
-            #Find the parameter or create it if it is new
-            parameter = get_param_by_name(param_name)
-            if not parameter:
-                parameter = Parameter(name=param_name, canonical_unit=guess_unit(param_name))
-                db.session.add(parameter)
-                db.session.commit()
-
-            #Create new SensorData entry
-            new_entry = SensorData(
-                sensor_id = sensor.id,
-                parameter_id = parameter.id,
-                timestamp = timestamp,
-                value = param_value
-            )
-            db.session.add(new_entry)
-
-            new_data.append({
-                'name': param_name,
-                'value': param_value,
-                'is_health': param_name in HEALTH_PARAMS
-            })
+        if current_app.config.get('INGEST_MODE') == 'spool':
+            for index, (payload, sensor) in zip(item_indexes, items):
+                spool.append(payload)
+                results[index] = {'index': index, 'status': 'accepted', 'sensor': sensor.name}
+            accepted = len(items)
+            return jsonify({
+                'accepted': accepted,
+                'rejected': len(results) - accepted,
+                'spooled': True,
+                'results': results
+            }), 202
 
         try:
-            db.session.commit()
+            stored = store_payloads(items)
+        except Exception as e:
+            print(f"Database batch insert error: {e}")
+            return jsonify({"error": "Database error, batch not stored"}), 500
 
-            #Real time data
-            emit_event("sensor_update", {
-                "sensor": sensor.name,
-                "timestamp": timestamp.isoformat(),
-                "measurements": new_data
-            })
+        row_count = 0
+        for index, (payload, sensor), result in zip(item_indexes, items, stored):
+            if isinstance(result, int):
+                row_count += result
+                results[index] = {'index': index, 'status': 'accepted', 'sensor': sensor.name, 'rows': result}
+            else:
+                results[index] = {'index': index, 'status': 'rejected', 'error': result}
 
-            return jsonify({'message': 'Data received and stored successfully'}), 200
+        elapsed = time.perf_counter() - started
+        accepted = sum(1 for r in results if r['status'] == 'accepted')
 
-        except Exception as e:
-            db.session.rollback()
-            print(f"Database insert error: {e}")
-            return jsonify({"error": str(e)}), 500
+        return jsonify({
+            'accepted': accepted,
+            'rejected': len(results) - accepted,
+            'rows': row_count,
+            'elapsed_ms': round(elapsed * 1000, 2),
+            'rows_per_second': round(row_count / elapsed, 1) if elapsed > 0 else None,
+            'results': results
+        }), 200
+
+    @server.route('/ingest/stats', methods=['GET'])
+    def ingest_stats():
+        return jsonify({
+            'mode': current_app.config.get('INGEST_MODE'),
+            'queue': ingest_queue.snapshot(),
+            'spool': spool.snapshot(),
+            'parsers': parsers.stats,
+            'dedup': dict(dedup_stats, recent_keys=len(recent_keys))
+        }), 200
+
+    @server.route('/data-cache/stats', methods=['GET'])
+    def data_cache_stats():
+        return jsonify(data_cache.snapshot()), 200
+
+    @server.route('/sensor-image/<name>', methods=['GET'])
+    def sensor_image(name):
+        """
+        Sensor photo at ?size=thumb|full. Links carry the image ETag as ?v=,
+        so versioned URLs are cached for a year; others revalidate daily.
+        """
+        size = request.args.get('size', 'full')
+        if size not in ('thumb', 'full'):
+            return jsonify({'error': "size must be 'thumb' or 'full'"}), 400
+
+        image = get_sensor_image(name, size)
+        if not image:
+            return jsonify({'error': f"No image for sensor '{name}'"}), 404
+
+        data, content_type, etag = image
+        response = Response(data, mimetype=content_type)
+        response.set_etag(f"{etag}-{size}")
+        if request.args.get('v') == etag:
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = 86400
+        return response.make_conditional(request)
+
+    def export_args():
+        """
+        (start, end, format, lora) from the query string of a download, or
+        an error message. Dates are whole days in the sensor's timezone.
+        """
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return None, f"format must be one of {', '.join(EXPORT_FORMATS)}"
+        try:
+            start_date = parse_date(request.args['start']).replace(hour=0, minute=0, second=0, microsecond=0)
+            end_date = parse_date(request.args['end']).replace(hour=23, minute=59, second=59, microsecond=0)
+        except (KeyError, ValueError, OverflowError):
+            return None, "start and end must be dates (YYYY-MM-DD)"
+        if end_date < start_date:
+            return None, "end is before start"
+        return (start_date, end_date, fmt, request.args.get('type') == 'lora'), None
+
+    @server.route('/download/<sensor_name>', methods=['GET'])
+    def download_data(sensor_name):
+        """
+        Streams a sensor's data as ?format=csv (default), parquet or arrow.
+        ?start and ?end are dates, ?type=lora exports the LoRaWAN health
+        parameters instead, ?filename names the file. CSV is gzipped on the
+        fly when the client accepts it; Parquet and Arrow are zstd-compressed
+        internally.
+        """
+        if not get_sensor_meta(sensor_name):
+            return jsonify({'error': f"Sensor '{sensor_name}' not found"}), 404
+
+        args, error = export_args()
+        if error:
+            return jsonify({'error': error}), 400
+        start_date, end_date, fmt, lora = args
+        mimetype, extension = EXPORT_FORMATS[fmt]
+
+        filename = secure_filename(request.args.get('filename', '')) \
+            or f"{secure_filename(sensor_name) or 'sensor'}_{start_date:%Y%m%d}_{end_date:%Y%m%d}"
+
+        chunks = iter_export(sensor_name, start_date, end_date, fmt, lora=lora)
+        headers = {'Content-Disposition': f'attachment; filename="{filename}.{extension}"'}
+        if fmt == 'csv':
+            headers['Vary'] = 'Accept-Encoding'
+            if request.accept_encodings['gzip']:
+                chunks = gzip_chunks(chunks)
+                headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+    @server.route('/bulk-download', methods=['GET'])
+    def bulk_download():
+        """
+        Streams one ZIP with a file per sensor. Sensors are given as repeated
+        or comma-separated ?sensors=, or all sensors of a ?device_type=.
+        Takes the same start, end, format, type and filename as /download.
+        """
+        args, error = export_args()
+        if error:
+            return jsonify({'error': error}), 400
+        start_date, end_date, fmt, lora = args
+
+        names = [n for value in request.args.getlist('sensors') for n in value.split(',') if n]
+        device_type = request.args.get('device_type')
+        if device_type:
+            names += get_sensors_grouped_by_type().get(device_type, [])
+        names = list(dict.fromkeys(names))
+        if not names:
+            return jsonify({'error': "Give sensors or a device_type with sensors"}), 400
+
+        unknown = [name for name in names if not get_sensor_meta(name)]
+        if unknown:
+            return jsonify({'error': f"Sensors not found: {', '.join(unknown)}"}), 404
+
+        filename = secure_filename(request.args.get('filename', '')) \
+            or f"{secure_filename(device_type or '') or 'sensors'}_{start_date:%Y%m%d}_{end_date:%Y%m%d}"
+
+        chunks = iter_bulk_zip(names, start_date, end_date, fmt, lora,
+                               workers=current_app.config['BULK_EXPORT_WORKERS'])
+        return Response(stream_with_context(chunks), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}.zip"'})
+
+    @server.route('/api/sensors/<sensor_name>/data', methods=['GET'])
+    def api_sensor_data(sensor_name):
+        """
+        Read API. ?start and ?end are ISO 8601 (UTC unless an offset is given;
+        default the last 24 hours up to now), ?params a comma-separated list of
+        parameter names, ?resolution raw (default), hourly, daily or auto,
+        ?limit the page size.
+
+        Pages are ordered by (timestamp, parameter) and chained with ?cursor
+        set to the previous next_cursor. Polling with the last next_cursor
+        returns only rows added after it (rows backfilled with older
+        timestamps are not seen). Responses carry a weak ETag for
+        If-None-Match and are gzipped when accepted.
+        """
+        if not get_sensor_meta(sensor_name):
+            return jsonify({'error': f"Sensor '{sensor_name}' not found"}), 404
+
+        try:
+            end_date = parse_utc(request.args['end']) if request.args.get('end') else None
+            start_date = parse_utc(request.args['start']) if request.args.get('start') \
+                else (end_date or datetime.utcnow()) - timedelta(days=1)
+            after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+            limit = int(request.args.get('limit', 1000))
+        except (ValueError, OverflowError) as e:
+            return jsonify({'error': f"Invalid start, end, cursor or limit: {e}"}), 400
+
+        max_limit = current_app.config['API_MAX_PAGE_SIZE']
+        if not 1 <= limit <= max_limit:
+            return jsonify({'error': f"limit must be between 1 and {max_limit}"}), 400
+
+        resolution = request.args.get('resolution', 'raw')
+        if resolution not in ('raw', 'hourly', 'daily', 'auto'):
+            return jsonify({'error': "resolution must be raw, hourly, daily or auto"}), 400
+
+        parameters = [p for p in request.args.get('params', '').split(',') if p]
+        rows, resolution, has_more = get_data_page(sensor_name, start_date, end_date, parameters,
+                                                   resolution, after, limit)
+
+        units = {}
+        data = []
+        for row in rows:
+            units[row.name] = row.unit
+            data.append({'timestamp': row.timestamp.isoformat() + 'Z', 'parameter': row.name, 'value': row.value})
+
+        if rows:
+            next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].parameter_id)
+        else:
+            next_cursor = request.args.get('cursor')  # Nothing new: poll again from the same place
+
+        body = json.dumps({
+            'sensor': sensor_name,
+            'resolution': resolution,
+            'units': units,
+            'data': data,
+            'has_more': has_more,
+            'next_cursor': next_cursor,
+        }, separators=(',', ':')).encode()
+
+        response = Response(body, mimetype='application/json')
+        # Weak: the same data is sent gzipped or not
+        response.set_etag(hashlib.sha1(body).hexdigest(), weak=True)
+        response.vary.add('Accept-Encoding')
+        response = response.make_conditional(request)
+        if response.status_code == 200 and len(body) > 1024 and request.accept_encodings['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=6))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    @server.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    def collect_ingest_stats():
+        queue_stats = ingest_queue.snapshot()
+        spool_stats = spool.snapshot()
+        return [
+            ('ingest_queue_depth', 'gauge', 'Uplinks waiting for the queued writer',
+             [({}, queue_stats['queue_depth'])]),
+            ('ingest_queue_groups_total', 'counter', 'Groups committed by the queued writer, and attempts retried after a database error',
+             [({'outcome': 'committed'}, queue_stats['groups_committed']),
+              ({'outcome': 'failed'}, queue_stats['groups_failed'])]),
+            ('ingest_queue_last_group_size', 'gauge', 'Uplinks in the last committed group',
+             [({}, queue_stats['last_group_size'])]),
+            ('ingest_spool_backlog_bytes', 'gauge', 'Spooled bytes not yet replayed',
+             [({}, spool_stats['backlog_bytes'])]),
+            ('ingest_spool_replay_errors_total', 'counter', 'Failed spool replay attempts',
+             [({}, spool_stats['replay_errors'])]),
+            ('ingest_spool_quarantined_total', 'counter', 'Spooled records moved to the quarantine file',
+             [({}, spool_stats['records_quarantined'])]),
+            ('ingest_spool_corrupt_regions_total', 'counter', 'Corrupt regions skipped in the spool file',
+             [({}, spool_stats['corrupt_regions'])]),
+            ('ingest_dedup_total', 'counter', 'Duplicate rows dropped, by where they were caught',
+             [({'stage': 'lru'}, dedup_stats['lru_hits']),
+              ({'stage': 'database'}, dedup_stats['db_conflicts'])]),
+            ('ingest_parse_failures_total', 'counter', 'Payloads a parser could not read, by format',
+             [({'format': fmt}, stats['failed']) for fmt, stats in parsers.stats.items()]),
+        ]
+
+    metrics.register_collector(collect_ingest_stats)
+
+    def collect_data_cache_stats():
+        cache_stats = data_cache.snapshot()
+        return [
+            ('data_cache_lookups_total', 'counter', 'get_data cache bucket lookups',
+             [({'result': 'hit'}, cache_stats['hits']),
+              ({'result': 'miss'}, cache_stats['misses'])]),
+            ('data_cache_evictions_total', 'counter', 'Buckets evicted to stay under the memory cap',
+             [({}, cache_stats['evictions'])]),
+            ('data_cache_invalidations_total', 'counter', 'Buckets dropped by ingest',
+             [({}, cache_stats['invalidations'])]),
+            ('data_cache_entries', 'gauge', 'Buckets held by the get_data cache',
+             [({}, cache_stats['entries'])]),
+            ('data_cache_bytes', 'gauge', 'Estimated memory held by the get_data cache',
+             [({}, cache_stats['bytes'])]),
+        ]
 
+    metrics.register_collector(collect_data_cache_stats)
@@ -0,0 +1,345 @@
+import base64
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from .database import db
+from .socketio import socketio
+
+# Record header: payload length and CRC32 of the payload, both big-endian.
+HEADER = struct.Struct('>II')
+# Longer lengths are treated as corrupt headers
+MAX_RECORD_BYTES = 1 << 20
+SCAN_BYTES = 1 << 16
+
+
+def encode_payload(payload):
+    """Parsed payload -> JSON bytes. Timestamps are stored as ISO strings."""
+    measurements = dict(payload['measurements'])
+    timestamp = measurements.get('timestamp')
+    if isinstance(timestamp, datetime):
+        measurements['timestamp'] = timestamp.isoformat()
+    record = {
+        "sensor_name": payload['sensor_name'],
+        "measurements": measurements,
+        "lat": payload.get('lat'),
+        "lon": payload.get('lon')
+    }
+    return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+def decode_payload(data):
+    payload = json.loads(data)
+    timestamp = payload['measurements'].get('timestamp')
+    if timestamp:
+        payload['measurements']['timestamp'] = datetime.fromisoformat(timestamp)
+    return payload
+
+
+class Spool:
+    """
+    Append-only local spool of accepted uplinks.
+
+    Routes append parsed payloads and reply immediately; fsync is batched
+    (every fsync_every records or fsync_ms, whichever comes first). A replay
+    worker drains the file into the database in groups and records its
+    progress in a checkpoint file, so uplinks survive database outages and
+    process restarts. Once the replay catches up the file is truncated.
+
+    A bad record with nothing intact after it is a torn append and is cut off
+    at startup. Corrupt bytes in the middle of the file are quarantined and
+    replay resumes at the next intact record.
+
+    Records that cannot be stored (undecodable, or rejected by validation or
+    the database) are appended to a quarantine file (path + '.quarantine',
+    one JSON object per line with the reason) and replay moves past them.
+    Only connectivity and operational errors keep the checkpoint and retry.
+    """
+
+    def __init__(self, fsync_every=100, fsync_ms=50, max_group=1000, compact_bytes=16 * 1024 * 1024):
+        self.path = None
+        self.checkpoint_path = None
+        self.quarantine_path = None
+        self.fsync_every = fsync_every
+        self.fsync_ms = fsync_ms
+        self.max_group = max_group
+        self.compact_bytes = compact_bytes
+        self.running = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self.stats = {
+            "records_appended": 0,
+            "records_replayed": 0,
+            "records_skipped": 0,
+            "records_quarantined": 0,
+            "corrupt_regions": 0,
+            "fsyncs": 0,
+            "replay_errors": 0,
+            "last_replay_error": None,
+            "compactions": 0,
+        }
+
+    # --- writer side ---
+
+    def open(self, path):
+        self.path = path
+        self.checkpoint_path = path + '.ckpt'
+        self.quarantine_path = path + '.quarantine'
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._recover()
+        self._file = open(self.path, 'ab')
+
+    def append(self, payload):
+        data = encode_payload(payload)
+        record = HEADER.pack(len(data), zlib.crc32(data)) + data
+        with self._lock:
+            self._file.write(record)
+            self._file.flush()
+            self._unsynced += 1
+            self.stats["records_appended"] += 1
+            if (self._unsynced >= self.fsync_every
+                    or (time.monotonic() - self._last_fsync) * 1000 >= self.fsync_ms):
+                self._fsync()
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self.stats["fsyncs"] += 1
+
+    def _sync_pending(self):
+        with self._lock:
+            if self._unsynced:
+                self._fsync()
+
+    # --- checkpoints ---
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, offset):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _recover(self):
+        """
+        Drops a torn record left at the end of the file by a crash mid-append.
+        Corrupt regions followed by intact records are left for the replay to
+        quarantine.
+        """
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        offset = self.read_checkpoint()
+        if offset > size:
+            # Crash while compacting: everything in the file is new
+            print(f"Spool: checkpoint {offset} is past the end of the file ({size} bytes), replaying from the start")
+            self.write_checkpoint(0)
+            offset = 0
+
+        with open(self.path, 'rb') as f:
+            while True:
+                f.seek(offset)
+                records, offset = self._read_records(f, offset, self.max_group)
+                if records:
+                    continue
+                if offset >= size:
+                    break
+                next_offset = self._next_record(f, offset)
+                if next_offset is None:
+                    break
+                print(f"Spool: corrupt bytes at offsets {offset}-{next_offset}, quarantined on replay")
+                offset = next_offset
+
+        if offset < size:
+            print(f"Spool: truncating torn record at offset {offset}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+    # --- replay side ---
+
+    def _read_records(self, f, offset, limit):
+        """Intact records from f's position, stopping at the first bad or incomplete one."""
+        records = []
+        while len(records) < limit:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            length, crc = HEADER.unpack(header)
+            if not 0 < length <= MAX_RECORD_BYTES:
+                break
+            data = f.read(length)
+            if len(data) < length or zlib.crc32(data) != crc:
+                break
+            records.append(data)
+            offset += HEADER.size + length
+        return records, offset
+
+    def _next_record(self, f, offset):
+        """
+        Offset of the first intact record after a bad one at offset, or None
+        when nothing intact follows (a torn tail, or an append in progress).
+        """
+        size = os.fstat(f.fileno()).st_size
+        position = offset + 1
+        while position + HEADER.size < size:
+            f.seek(position)
+            window = f.read(SCAN_BYTES + HEADER.size)
+            for i in range(min(SCAN_BYTES, len(window) - HEADER.size)):
+                length, crc = HEADER.unpack_from(window, i)
+                start = position + i + HEADER.size
+                if not 0 < length <= MAX_RECORD_BYTES or start + length > size:
+                    continue
+                if i + HEADER.size + length <= len(window):
+                    data = window[i + HEADER.size:i + HEADER.size + length]
+                else:
+                    f.seek(start)
+                    data = f.read(length)
+                if zlib.crc32(data) == crc:
+                    return position + i
+            position += SCAN_BYTES
+        return None
+
+    def _skip_corrupt(self, offset):
+        """
+        Quarantines the corrupt bytes at offset up to the next intact record
+        and moves the checkpoint there. Returns False when nothing intact
+        follows yet.
+        """
+        with open(self.path, 'rb') as f:
+            next_offset = self._next_record(f, offset)
+            if next_offset is None:
+                return False
+            f.seek(offset)
+            data = f.read(next_offset - offset)
+
+        self.stats["corrupt_regions"] += 1
+        self._quarantine([(data, f"Corrupt spool bytes at offsets {offset}-{next_offset}")], raw=True)
+        self.write_checkpoint(next_offset)
+        return True
+
+    def start(self, app):
+        if not self.running:
+            self.running = True
+            socketio.start_background_task(self._run, app)
+
+    def backlog_bytes(self):
+        if not self.path:
+            return 0
+        try:
+            return max(os.path.getsize(self.path) - self.read_checkpoint(), 0)
+        except FileNotFoundError:
+            return 0
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats["backlog_bytes"] = self.backlog_bytes()
+        return stats
+
+    def _run(self, app):
+        from .ingest import store_payloads_isolated
+        from .models import get_sensor_meta
+
+        backoff = 0.5
+        with app.app_context():
+            while self.running:
+                self._sync_pending()
+                offset = self.read_checkpoint()
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    records, next_offset = self._read_records(f, offset, self.max_group)
+
+                if not records:
+                    if offset < os.path.getsize(self.path) and self._skip_corrupt(offset):
+                        continue
+                    self._compact(offset)
+                    socketio.sleep(self.fsync_ms / 1000.0)
+                    continue
+
+                items = []
+                sources = []   # record of each item, for the quarantine
+                rejected = []  # (record, reason)
+                try:
+                    for data in records:
+                        try:
+                            payload = decode_payload(data)
+                        except ValueError as e:
+                            rejected.append((data, f"Undecodable record: {e}"))
+                            continue
+                        sensor = get_sensor_meta(payload['sensor_name'])
+                        if sensor:
+                            items.append((payload, sensor))
+                            sources.append(data)
+                        else:
+                            self.stats["records_skipped"] += 1
+                    results = store_payloads_isolated(items)
+                except Exception as e:
+                    # Database slow or down: keep the checkpoint and retry the same records
+                    self.stats["replay_errors"] += 1
+                    self.stats["last_replay_error"] = str(e)
+                    print(f"Spool replay error (retrying in {backoff}s): {e}")
+                    socketio.sleep(backoff)
+                    backoff = min(backoff * 2, 30)
+                    continue
+                finally:
+                    db.session.remove()
+
+                for data, result in zip(sources, results):
+                    if isinstance(result, int):
+                        self.stats["records_replayed"] += 1
+                    else:
+                        rejected.append((data, str(result)))
+                if rejected:
+                    self._quarantine(rejected)
+
+                self.write_checkpoint(next_offset)
+                backoff = 0.5
+
+    def _quarantine(self, rejected, raw=False):
+        """
+        Appends records that can never be stored to the quarantine file.
+        raw=True stores the bytes base64-encoded (corrupt regions).
+        """
+        quarantined_at = datetime.utcnow().isoformat()
+        with open(self.quarantine_path, 'a') as f:
+            for data, reason in rejected:
+                print(f"Spool: quarantining record ({reason})")
+                entry = {"quarantined_at": quarantined_at, "error": reason}
+                if raw:
+                    entry["bytes_base64"] = base64.b64encode(data).decode('ascii')
+                else:
+                    entry["record"] = data.decode('utf-8', 'replace')
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["records_quarantined"] += len(rejected)
+
+    def _compact(self, offset):
+        """Truncates the spool once everything in it has been replayed."""
+        if offset < self.compact_bytes:
+            return
+        with self._lock:
+            if os.path.getsize(self.path) != offset:
+                return  # New records arrived, compact on a later pass
+            # Checkpoint first: a crash in between replays the records again
+            # (dropped as duplicates) instead of leaving the checkpoint past
+            # the end of the file
+            self.write_checkpoint(0)
+            self._file.truncate(0)
+            self._file.seek(0)
+            self.stats["compactions"] += 1
+
+
+spool = Spool()
@@ -1,84 +1,59 @@
 import pandas as pd
+import numpy as np
 import io
 import base64
 from PIL import Image, ImageOps
-from collections import defaultdict
 import dash_bootstrap_components as dbc
 from dash import html
 import dash_leaflet as dl
 from dateutil.parser import parse as parse_date
+from urllib.parse import quote
 
 # from server.models import get_sensor_timezone, get_sensor_by_name, get_most_recent, get_all_sensors
 # TO DO: Refactor so function's here are "pure" and do not rely on DB import. This will avoid inline
 # imports and circular imports
 
-def save_data_to_csv(data, sensor_name):
-    from server.models import get_sensor_timezone
-    organized_data = defaultdict(dict)
+# Pre-generated sizes served by /sensor-image/<name>: map popups and the dashboard card
+IMAGE_SIZES = {
+    "thumb": (160, 160),
+    "full": (800, 800),
+}
 
-    timezone_str = get_sensor_timezone(sensor_name)
-
-    for timestamp, value, parameter, unit in data:
-        organized_data[timestamp][f"{parameter} {f'({unit})' if unit else ''}"] = value
-
-    # Create a DataFrame from the organized data
-    df = pd.DataFrame.from_dict(organized_data, orient='index').reset_index()
-
-    # Rename the first column to 'timestamp (timezone)'
-    formatted_time = f"timestamp ({timezone_str})"
-    df.rename(columns={'index': formatted_time}, inplace=True)
-
-    # Convert the DataFrame to a CSV string
-    csv_data = df.to_csv(index=False)
-    sensor_name_line = f"Sensor Name: {sensor_name}\n"
-    csv_data = sensor_name_line + csv_data
-
-    return csv_data
-
-def compress_image(base64_string, max_size=(800, 800), quality=70):
+def make_image_sizes(base64_string, quality=70):
     """
-    Accepts a base64 string, resizes/compresses it, and returns a new base64 string.
+    Accepts an uploaded base64 image (data URI or bare base64) and returns
+    {size name: JPEG bytes} for every entry in IMAGE_SIZES, or None if the
+    image can not be read.
     """
     try:
-        # Split header (e.g. "data:image/png;base64,") from data
-        if ',' in base64_string:
-            header, data = base64_string.split(',', 1)
-        else:
-            header = "data:image/jpeg;base64"  # Default assumption
-            data = base64_string
-
-        # Decode to bytes
-        image_bytes = base64.b64decode(data)
-        img = Image.open(io.BytesIO(image_bytes))
+        data = base64_string.split(',', 1)[1] if ',' in base64_string else base64_string
+        img = Image.open(io.BytesIO(base64.b64decode(data)))
 
         #Fix orientation
         img = ImageOps.exif_transpose(img)
-
-        # Convert to RGB (if PNG has transparency, this avoids errors saving as JPEG)
         if img.mode in ("RGBA", "P"):
             img = img.convert("RGB")
 
-        # Resize and save
-        img.thumbnail(max_size)
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=quality)
-
-        # Re-encode to Base64
-        new_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-
-        return f"data:image/jpeg;base64,{new_data}"
+        sizes = {}
+        for name, max_size in IMAGE_SIZES.items():
+            resized = img.copy()
+            resized.thumbnail(max_size)
+            buffer = io.BytesIO()
+            resized.save(buffer, format="JPEG", quality=quality)
+            sizes[name] = buffer.getvalue()
+        return sizes
 
     except Exception as e:
-        print(f"Image compression error: {e}")
-        return base64_string  # Return original if compression fails
+        print(f"Image processing error: {e}")
+        return None
 
 def get_measurement_summary(sensor_name, include_health=False):
     """
     Fetches the single most recent data this sensor has reported.
     Excludes sensor health related data
     """
-    from server.models import get_sensor_by_name, get_most_recent
-    sensor = get_sensor_by_name(sensor_name)
+    from server.models import get_sensor_meta, get_most_recent
+    sensor = get_sensor_meta(sensor_name)
     if not sensor:
         return {"error": f"Sensor '{sensor_name}' not found"}
 
@@ -116,10 +91,10 @@ def get_measurement_summary(sensor_name, include_health=False):
 
 def get_deployment_statistics(sensor_name, deploy_data):
     """
-    Takes a deployment dictionary, fetches the historical data,
-    and returns duration, dates, and the mean of each parameter.
+    Takes a deployment dictionary and returns duration, dates, and count,
+    mean, min, max, standard deviation and percentiles of each parameter.
     """
-    from server.models import get_data
+    from server.models import get_deployment_stats
 
     if not deploy_data:
         return {"error": "No deployment data provided."}
@@ -129,37 +104,22 @@ def get_deployment_statistics(sensor_name, deploy_data):
         "range": deploy_data.get('range', ''),
         "latitude": deploy_data.get('latitude', 0),
         "longitude": deploy_data.get('longitude', 0),
-        "averages": []
+        "parameters": []
     }
 
     try:
         start_date = parse_date(deploy_data['start_iso'])
         end_date = parse_date(deploy_data['end_iso']) if deploy_data.get('end_iso') else None
 
-        historic_data = get_data(sensor_name, start_date, end_date, lora=False)
-
-        if not historic_data:
-            return stats  # Averages list will just remain empty
+        # Aggregated in the database, and stored once the deployment is closed
+        aggregates = get_deployment_stats(sensor_name, start_date, end_date,
+                                          deployment_id=deploy_data.get('id'))
 
-        param_totals = {}
-        param_counts = {}
-        param_units = {}
-
-        for row in historic_data:
-            if row.name in ["latitude", "longitude"]:
+        for param, agg in sorted(aggregates.items()):
+            if param in ["latitude", "longitude"]:
                 continue  # Skip coordinates
 
-            param_totals[row.name] = param_totals.get(row.name, 0) + row.value
-            param_counts[row.name] = param_counts.get(row.name, 0) + 1
-            param_units[row.name] = row.unit
-
-        for param, total in param_totals.items():
-            avg_val = total / param_counts[param]
-            stats["averages"].append({
-                "parameter": param,
-                "value": avg_val,
-                "unit": param_units[param]
-            })
+            stats["parameters"].append(dict(agg, parameter=param))
 
     except Exception as e:
         print(f"Error calculating deployment statistics: {e}")
@@ -167,6 +127,43 @@ def get_deployment_statistics(sensor_name, deploy_data):
 
     return stats
 
+def shape_graph_series(frame, timezone, max_points=None, method='lttb', skip=("latitude", "longitude")):
+    """
+    Turns a get_data_frame result into one series per parameter in a single
+    columnar pass: one vectorized UTC -> local conversion, one grouping by
+    parameter, no per-row Python. Rows arrive ordered by timestamp and the
+    grouping keeps that order, so nothing is re-sorted.
+
+    Returns {parameter: {"timestamps", "values", "unit"}} in first-seen order,
+    timestamps as naive local datetime64 and values as float arrays, each
+    downsampled to max_points when given.
+    """
+    from server.downsample import downsample
+
+    frame = frame[~frame['name'].isin(skip)]
+    if frame.empty:
+        return {}
+
+    local = frame['timestamp'].dt.tz_localize('UTC').dt.tz_convert(timezone).dt.tz_localize(None)
+    timestamps = local.to_numpy()
+    values = frame['value'].to_numpy(dtype=float)
+    units = frame['unit'].to_numpy()
+
+    # Group rows by parameter: a stable sort of the codes keeps time order within each group
+    codes, names = pd.factorize(frame['name'])
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+
+    series = {}
+    for i, name in enumerate(names):
+        rows = order[bounds[i]:bounds[i + 1]]
+        x, y = timestamps[rows], values[rows]
+        if max_points and len(y) > max_points:
+            keep = downsample(x.astype('datetime64[us]').astype(np.int64), y, max_points, method)
+            x, y = x[keep], y[keep]
+        series[name] = {"timestamps": x, "values": y, "unit": units[rows[0]]}
+    return series
+
 def create_map_markers(selected_sensor_name=None, show_inactive=False):
     """
     Generates map markers.
@@ -247,9 +244,17 @@ def create_map_markers(selected_sensor_name=None, show_inactive=False):
 
         display_type = s_type.replace('_', ' ').title() if s_type else 'Unknown'
 
+        # Thumbnail from the image endpoint; the version makes it cacheable forever
+        image_version = s.get('image_version')
+        thumbnail = [html.Img(
+            src=f"/sensor-image/{quote(name)}?size=thumb&v={image_version}",
+            className="d-block mx-auto mb-2",
+            style={"maxWidth": "100%", "maxHeight": "120px", "objectFit": "contain"}
+        )] if image_version else []
+
         popup_content = dbc.Card([
             dbc.CardHeader(name, className=header_class, style=header_style),
-            dbc.CardBody([
+            dbc.CardBody(thumbnail + [
                 html.P(f"Type: {display_type}", className="small mb-1"),
                 html.P(f"Status: {status_text}", className="small mb-2 fw-bold"),
 